@@ -1,8 +1,864 @@
-import boto3
 import os
 import csv
+import functools
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import queue
+import sqlite3
+import tempfile
+import threading
 import time
-from aws_session import get_s3_client
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+from aws_session import TokenBucket, get_s3_client
+
+MB = 1024 * 1024
+
+# -----------------------------
+# CONFIGURACIÓN DE TRANSFERENCIAS (multipart)
+# Perfil único para todas las subidas/descargas; se ajusta por despliegue con
+# variables de entorno o con configurar_transferencias()
+# -----------------------------
+_transfer_config = None
+
+
+def crear_transfer_config(multipart_threshold_mb=None, multipart_chunksize_mb=None,
+                          max_concurrency=None, max_io_queue=None):
+    """
+    Crea un TransferConfig de boto3. Los valores no indicados se leen de
+    S3_MULTIPART_THRESHOLD_MB, S3_MULTIPART_CHUNKSIZE_MB, S3_MAX_CONCURRENCY y S3_MAX_IO_QUEUE.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    if multipart_threshold_mb is None:
+        multipart_threshold_mb = float(os.getenv("S3_MULTIPART_THRESHOLD_MB", "16"))
+    if multipart_chunksize_mb is None:
+        multipart_chunksize_mb = float(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "16"))
+    if max_concurrency is None:
+        # No conviene superar AWS_MAX_POOL_CONNECTIONS: el resto de hilos esperaría conexión libre
+        max_concurrency = int(os.getenv("S3_MAX_CONCURRENCY", "16"))
+    if max_io_queue is None:
+        max_io_queue = int(os.getenv("S3_MAX_IO_QUEUE", "100"))
+
+    return TransferConfig(
+        multipart_threshold=int(multipart_threshold_mb * MB),
+        multipart_chunksize=int(multipart_chunksize_mb * MB),
+        max_concurrency=max_concurrency,
+        max_io_queue=max_io_queue,
+        use_threads=max_concurrency > 1
+    )
+
+
+def configurar_transferencias(**kwargs):
+    """Fija el perfil de transferencia por defecto (mismos parámetros que crear_transfer_config)."""
+    global _transfer_config
+    _transfer_config = crear_transfer_config(**kwargs)
+    return _transfer_config
+
+
+def obtener_transfer_config(transfer_config=None):
+    """Devuelve el TransferConfig indicado o, si es None, el perfil por defecto."""
+    global _transfer_config
+    if transfer_config is not None:
+        return transfer_config
+    if _transfer_config is None:
+        _transfer_config = crear_transfer_config()
+    return _transfer_config
+
+
+# -----------------------------
+# COPIAS EN EL SERVIDOR
+# -----------------------------
+# Límite de CopyObject en una sola petición; por encima hay que usar UploadPartCopy
+COPY_OBJECT_MAX_BYTES = 5 * 1024 * MB
+
+
+# Cabeceras que CopyObject conserva por defecto y que hay que trasladar a mano en la copia multipart
+CAMPOS_METADATOS = ("CacheControl", "ContentDisposition", "ContentEncoding", "ContentLanguage",
+                    "ContentType", "Expires", "Metadata")
+
+
+def copiar_objeto(s3_client, bucket_name, key_origen, key_destino, tamano=None,
+                  extra_args=None, bucket_origen=None, transfer_config=None):
+    """
+    Copia un objeto dentro de S3 sin pasar por el cliente. Hasta 5 GB usa una
+    sola llamada CopyObject; por encima, copia multipart con UploadPartCopy en
+    paralelo, conservando igualmente metadatos y etiquetas del origen.
+    """
+    bucket_origen = bucket_origen or bucket_name
+    copy_source = {"Bucket": bucket_origen, "Key": key_origen}
+    extra_args = dict(extra_args or {})
+
+    head = None
+    if tamano is None:
+        head = s3_client.head_object(Bucket=bucket_origen, Key=key_origen)
+        tamano = head["ContentLength"]
+
+    if tamano <= COPY_OBJECT_MAX_BYTES:
+        return s3_client.copy_object(
+            CopySource=copy_source,
+            Bucket=bucket_name,
+            Key=key_destino,
+            **extra_args
+        )
+
+    head = head or s3_client.head_object(Bucket=bucket_origen, Key=key_origen)
+    for campo in CAMPOS_METADATOS:
+        if campo in head:
+            extra_args.setdefault(campo, head[campo])
+    etiquetas = s3_client.get_object_tagging(Bucket=bucket_origen, Key=key_origen).get("TagSet", [])
+
+    s3_client.copy(
+        CopySource=copy_source,
+        Bucket=bucket_name,
+        Key=key_destino,
+        ExtraArgs=extra_args,
+        Config=obtener_transfer_config(transfer_config)
+    )
+    if etiquetas:
+        s3_client.put_object_tagging(Bucket=bucket_name, Key=key_destino, Tagging={"TagSet": etiquetas})
+
+
+# -----------------------------
+# SUBIDAS EN STREAMING (sin archivos temporales)
+# -----------------------------
+# Tamaño mínimo de parte en S3 (salvo la última)
+MIN_PART_BYTES = 5 * MB
+
+
+def _serializar_registros(registros, formato, cabecera=None):
+    """Convierte filas (CSV) o diccionarios (NDJSON) en bloques de bytes, registro a registro."""
+    if formato == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if cabecera:
+            writer.writerow(cabecera)
+        for fila in registros:
+            writer.writerow(fila)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode("utf-8")
+    elif formato == "ndjson":
+        for registro in registros:
+            yield (json.dumps(registro, ensure_ascii=False) + "\n").encode("utf-8")
+    else:
+        raise ValueError(f"Formato no soportado: {formato} (usa 'csv' o 'ndjson')")
+
+
+def subir_registros_stream(s3_client, bucket_name, key_s3, registros, formato="csv", cabecera=None,
+                           tamano_parte_mb=None, max_concurrencia=None, extra_args=None):
+    """
+    Serializa un iterador de registros (CSV o NDJSON) y lo sube como multipart
+    sin tocar disco. Las partes se suben en paralelo y como mucho hay
+    max_concurrencia + 1 partes en memoria, sea cual sea el tamaño del dataset.
+    """
+    config = obtener_transfer_config()
+    tamano_parte = max(MIN_PART_BYTES, int(tamano_parte_mb * MB) if tamano_parte_mb else config.multipart_chunksize)
+    max_concurrencia = max_concurrencia or config.max_concurrency
+    extra_args = dict(extra_args or {})
+    if formato == "csv":
+        extra_args.setdefault("ContentType", "text/csv")
+    else:
+        extra_args.setdefault("ContentType", "application/x-ndjson")
+
+    huecos = threading.BoundedSemaphore(max_concurrencia)
+    buffer = bytearray()
+    upload_id = None
+    futures = []
+    fallos = []
+    total = 0
+
+    def subir_parte(numero, datos):
+        try:
+            response = s3_client.upload_part(
+                Bucket=bucket_name, Key=key_s3, UploadId=upload_id,
+                PartNumber=numero, Body=bytes(datos)
+            )
+            return {"PartNumber": numero, "ETag": response["ETag"]}
+        except Exception as e:
+            fallos.append(e)
+            raise
+        finally:
+            huecos.release()
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrencia)
+    try:
+        for bloque in _serializar_registros(registros, formato, cabecera):
+            buffer += bloque
+            total += len(bloque)
+            # Partes de exactamente tamano_parte (el resto pasa a la siguiente): ETag multipart verificable
+            while len(buffer) >= tamano_parte:
+                if fallos:
+                    raise fallos[0]  # no seguir serializando el dataset si ya ha fallado una parte
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(
+                        Bucket=bucket_name, Key=key_s3, **extra_args
+                    )["UploadId"]
+                huecos.acquire()  # contrapresión: espera si ya hay max_concurrencia partes en vuelo
+                futures.append(executor.submit(subir_parte, len(futures) + 1, buffer[:tamano_parte]))
+                del buffer[:tamano_parte]
+
+        if upload_id is None:
+            # Dataset pequeño: una sola petición PutObject
+            s3_client.put_object(Bucket=bucket_name, Key=key_s3, Body=bytes(buffer), **extra_args)
+            return {"Key": key_s3, "Bytes": total, "Partes": 1}
+
+        if buffer:
+            huecos.acquire()
+            futures.append(executor.submit(subir_parte, len(futures) + 1, buffer))
+        partes = [future.result() for future in futures]
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=key_s3, UploadId=upload_id,
+            MultipartUpload={"Parts": partes}
+        )
+        return {"Key": key_s3, "Bytes": total, "Partes": len(partes)}
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        # Esperar a las partes en vuelo antes de abortar, para que ninguna llegue después del abort
+        executor.shutdown(wait=True)
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key_s3, UploadId=upload_id)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+
+# -----------------------------
+# SINCRONIZACIÓN INCREMENTAL (manifiesto local + hashes)
+# -----------------------------
+MANIFIESTO_POR_DEFECTO = ".s3_manifest.json"
+
+
+def _hash_archivo(ruta, tamano_parte=None):
+    """
+    Devuelve (md5, etag) del archivo. Con tamano_parte el ETag es el de una
+    subida multipart con partes de ese tamaño ("md5-de-md5s-N"); sin él, el MD5.
+    """
+    md5_total = hashlib.md5()
+    md5_partes = []
+    with open(ruta, "rb") as f:
+        while True:
+            md5_parte = hashlib.md5()
+            leido = 0
+            while tamano_parte is None or leido < tamano_parte:
+                bloque = f.read(MB if tamano_parte is None else min(MB, tamano_parte - leido))
+                if not bloque:
+                    break
+                md5_total.update(bloque)
+                md5_parte.update(bloque)
+                leido += len(bloque)
+            if not leido:
+                break
+            md5_partes.append(md5_parte.digest())
+
+    if tamano_parte is None:
+        return md5_total.hexdigest(), f'"{md5_total.hexdigest()}"'
+    return md5_total.hexdigest(), f'"{hashlib.md5(b"".join(md5_partes)).hexdigest()}-{len(md5_partes)}"'
+
+
+def calcular_hashes(ruta, transfer_config=None):
+    """
+    Lee el archivo una vez y devuelve su MD5 y el ETag que S3 le asignará al
+    subirlo con upload_file (MD5 simple o MD5 de partes "-N" si es multipart).
+    """
+    from s3transfer.utils import ChunksizeAdjuster
+
+    config = obtener_transfer_config(transfer_config)
+    tamano = os.path.getsize(ruta)
+    parte = None
+    if tamano >= config.multipart_threshold:
+        parte = ChunksizeAdjuster().adjust_chunksize(config.multipart_chunksize, tamano)
+    md5, etag = _hash_archivo(ruta, parte)
+    return {"md5": md5, "etag_esperado": etag}
+
+
+def _cargar_manifiesto(ruta):
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _guardar_json_atomico(ruta, datos):
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=2, sort_keys=True)
+    os.replace(temporal, ruta)
+
+
+def _listar_etags(s3_client, bucket_name, prefijo):
+    """Devuelve {key: ETag} del prefijo listándolo en paralelo con listar_paralelo, en vez de un HEAD por archivo."""
+    return {obj["Key"]: obj["ETag"] for obj in listar_paralelo(s3_client, bucket_name, prefijo)}
+
+
+def sincronizar_directorio(s3_client, bucket_name, directorio, prefijo="", manifiesto=None,
+                           max_workers=8, transfer_config=None, extra_args=None):
+    """
+    Sube solo los archivos del directorio cuyo contenido no coincide ya con el
+    objeto remoto. El manifiesto guarda tamaño, mtime, hash, ETag y VersionId
+    de cada archivo para no recalcular hashes de archivos que no han cambiado.
+    """
+    print(f"🔹 Sincronizando '{directorio}' con s3://{bucket_name}/{prefijo}...")
+    manifiesto = manifiesto or os.path.join(directorio, MANIFIESTO_POR_DEFECTO)
+    entradas = _cargar_manifiesto(manifiesto)
+    prefijo = f"{prefijo.rstrip('/')}/" if prefijo else ""
+
+    archivos = {}
+    for raiz, _, nombres in os.walk(directorio):
+        for nombre in nombres:
+            ruta = os.path.join(raiz, nombre)
+            if os.path.abspath(ruta) in (os.path.abspath(manifiesto), os.path.abspath(f"{manifiesto}.tmp")):
+                continue
+            relativa = os.path.relpath(ruta, directorio).replace(os.sep, "/")
+            archivos[relativa] = ruta
+
+    # 1. Hashes: solo para archivos nuevos o con tamaño/mtime distinto al del manifiesto
+    pendientes_hash = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for relativa, ruta in archivos.items():
+            st = os.stat(ruta)
+            entrada = entradas.get(relativa)
+            if entrada and entrada.get("size") == st.st_size and entrada.get("mtime_ns") == st.st_mtime_ns:
+                continue
+            entradas[relativa] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                  "md5_anterior": (entrada or {}).get("md5"),
+                                  "etag": (entrada or {}).get("etag"),
+                                  "version_id": (entrada or {}).get("version_id")}
+            pendientes_hash[relativa] = executor.submit(calcular_hashes, ruta, transfer_config)
+        for relativa, future in pendientes_hash.items():
+            entradas[relativa].update(future.result())
+
+    # 2. Comparación con el estado remoto
+    remotos = _listar_etags(s3_client, bucket_name, prefijo)
+    a_subir = []
+    for relativa in archivos:
+        entrada = entradas[relativa]
+        md5_anterior = entrada.pop("md5_anterior", entrada["md5"])
+        etag_remoto = remotos.get(f"{prefijo}{relativa}")
+        sin_cambios = etag_remoto is not None and (
+            etag_remoto == entrada["etag_esperado"]
+            # ETag no derivado del MD5 (p. ej. SSE-KMS): se confía en el último ETag subido
+            or (etag_remoto == entrada.get("etag") and md5_anterior == entrada["md5"])
+        )
+        if sin_cambios:
+            entrada["etag"] = etag_remoto
+        else:
+            a_subir.append(relativa)
+
+    # 3. Subidas en paralelo de lo que ha cambiado
+    def subir(relativa):
+        key = f"{prefijo}{relativa}"
+        s3_client.upload_file(
+            Filename=archivos[relativa],
+            Bucket=bucket_name,
+            Key=key,
+            ExtraArgs=extra_args,
+            Config=obtener_transfer_config(transfer_config)
+        )
+        head = s3_client.head_object(Bucket=bucket_name, Key=key)
+        return relativa, head["ETag"], head.get("VersionId")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for relativa, etag, version_id in executor.map(subir, a_subir):
+            entradas[relativa].update(etag=etag, version_id=version_id)
+            print(f"   ⤴ Subido '{relativa}'")
+
+    # Se olvidan los archivos borrados localmente
+    entradas = {k: v for k, v in entradas.items() if k in archivos}
+    _guardar_json_atomico(manifiesto, entradas)
+
+    omitidos = len(archivos) - len(a_subir)
+    print(f"✅ Sincronización completada: {len(a_subir)} subidos, {omitidos} sin cambios\n")
+    return {"subidos": a_subir, "omitidos": omitidos}
+
+
+# -----------------------------
+# DESCARGAS POR RANGOS EN PARALELO (con reanudación)
+# -----------------------------
+def _etag_por_partes(ruta, tamanos):
+    """ETag multipart ("md5-de-md5s-N") del archivo troceado con los tamaños de parte indicados."""
+    md5_partes = []
+    with open(ruta, "rb") as f:
+        for tamano in tamanos:
+            md5_parte = hashlib.md5()
+            pendiente = tamano
+            while pendiente:
+                bloque = f.read(min(MB, pendiente))
+                if not bloque:
+                    break
+                md5_parte.update(bloque)
+                pendiente -= len(bloque)
+            md5_partes.append(md5_parte.digest())
+    return f'"{hashlib.md5(b"".join(md5_partes)).hexdigest()}-{len(md5_partes)}"'
+
+
+def _verificar_descarga(s3_client, bucket_name, key_s3, ruta, head, version_id=None, max_workers=8):
+    """Comprueba el archivo descargado contra el ETag (simple o multipart) del objeto."""
+    # Con SSE-KMS / SSE-C el ETag no es un MD5 del contenido: no hay nada que comparar
+    # (la coherencia ya la garantiza el IfMatch de cada rango)
+    if head.get("ServerSideEncryption", "").startswith("aws:kms") or head.get("SSECustomerAlgorithm"):
+        return True
+    etag = head["ETag"]
+    if "-" not in etag:
+        return _hash_archivo(ruta)[1] == etag
+
+    # ETag multipart: las partes no tienen por qué medir lo mismo, se pide el tamaño real de cada una
+    num_partes = int(etag.strip('"').rsplit("-", 1)[1])
+    kwargs = {"VersionId": version_id} if version_id else {}
+
+    def tamano_parte(numero):
+        return s3_client.head_object(Bucket=bucket_name, Key=key_s3, PartNumber=numero, **kwargs)["ContentLength"]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tamanos = list(executor.map(tamano_parte, range(1, num_partes + 1)))
+    return _etag_por_partes(ruta, tamanos) == etag
+
+
+def descargar_objeto_rangos(s3_client, bucket_name, key_s3, nombre_local, version_id=None,
+                            transfer_config=None, max_workers=None):
+    """
+    Descarga el objeto en rangos de bytes pedidos en paralelo y escritos en su
+    posición de un archivo preasignado. El progreso se guarda en
+    '<nombre_local>.estado.json' para reanudar tras una interrupción, y el
+    resultado se verifica contra el ETag antes de moverlo a su nombre final.
+    """
+    config = obtener_transfer_config(transfer_config)
+    tamano_parte = config.multipart_chunksize
+    max_workers = max_workers or config.max_concurrency
+    version_kwargs = {"VersionId": version_id} if version_id else {}
+
+    head = s3_client.head_object(Bucket=bucket_name, Key=key_s3, **version_kwargs)
+    tamano = head["ContentLength"]
+    etag = head["ETag"]
+    # Fija la versión descargada aunque se suba otra durante la descarga
+    version_kwargs = {"VersionId": head["VersionId"]} if head.get("VersionId") else {}
+
+    parcial = f"{nombre_local}.parcial"
+    ruta_estado = f"{nombre_local}.estado.json"
+    estado = _cargar_manifiesto(ruta_estado)
+    reanudable = (
+        estado.get("etag") == etag
+        and estado.get("tamano") == tamano
+        and estado.get("tamano_parte") == tamano_parte
+        and os.path.exists(parcial)
+        and os.path.getsize(parcial) == tamano
+    )
+    if not reanudable:
+        estado = {"etag": etag, "tamano": tamano, "tamano_parte": tamano_parte, "completadas": []}
+        with open(parcial, "wb") as f:
+            f.truncate(tamano)  # preasigna el archivo completo
+
+    completadas = set(estado["completadas"])
+    num_partes = max(1, -(-tamano // tamano_parte))
+    pendientes = [n for n in range(num_partes) if n not in completadas]
+    if reanudable and completadas:
+        print(f"   ↻ Reanudando descarga: {len(completadas)}/{num_partes} partes ya descargadas")
+
+    lock_estado = threading.Lock()
+
+    def descargar_parte(numero):
+        inicio = numero * tamano_parte
+        fin = min(tamano, inicio + tamano_parte) - 1
+        if fin >= inicio:
+            response = s3_client.get_object(
+                Bucket=bucket_name, Key=key_s3, Range=f"bytes={inicio}-{fin}",
+                IfMatch=etag, **version_kwargs
+            )
+            with open(parcial, "r+b") as f:
+                f.seek(inicio)
+                for bloque in response["Body"].iter_chunks(MB):
+                    f.write(bloque)
+        with lock_estado:
+            completadas.add(numero)
+            estado["completadas"] = sorted(completadas)
+            _guardar_json_atomico(ruta_estado, estado)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(descargar_parte, pendientes))
+
+    if not _verificar_descarga(s3_client, bucket_name, key_s3, parcial, head, version_id=version_kwargs.get("VersionId")):
+        os.remove(parcial)
+        os.remove(ruta_estado)
+        raise ValueError(f"La descarga de '{key_s3}' no coincide con su ETag {etag}")
+
+    os.replace(parcial, nombre_local)
+    os.remove(ruta_estado)
+    return head
+
+
+def leer_objeto_rangos(s3_client, bucket_name, key_s3, tamano_parte=None, max_workers=4):
+    """
+    Generador de los bytes del objeto, en orden, pedidos por rangos en
+    paralelo. Solo hay 'max_workers' rangos en vuelo o en memoria a la vez,
+    así que objetos de cualquier tamaño se procesan con memoria constante.
+    """
+    head = s3_client.head_object(Bucket=bucket_name, Key=key_s3)
+    tamano = head["ContentLength"]
+    tamano_parte = tamano_parte or obtener_transfer_config().multipart_chunksize
+
+    def leer(inicio):
+        fin = min(tamano, inicio + tamano_parte) - 1
+        response = s3_client.get_object(
+            Bucket=bucket_name, Key=key_s3, Range=f"bytes={inicio}-{fin}", IfMatch=head["ETag"]
+        )
+        return response["Body"].read()
+
+    inicios = iter(range(0, tamano, tamano_parte))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        en_vuelo = deque(executor.submit(leer, inicio) for inicio in itertools.islice(inicios, max_workers))
+        while en_vuelo:
+            datos = en_vuelo.popleft().result()
+            siguiente = next(inicios, None)
+            if siguiente is not None:
+                en_vuelo.append(executor.submit(leer, siguiente))
+            yield datos
+
+
+# -----------------------------
+# CACHÉ LOCAL DE OBJETOS (por ETag / VersionId, con límite de bytes LRU)
+# -----------------------------
+CACHE_DIR = os.getenv("S3_CACHE_DIR", ".s3_cache")
+CACHE_MAX_BYTES = int(os.getenv("S3_CACHE_MAX_BYTES", str(1024 * MB)))
+
+
+class CacheObjetosLocal:
+    """
+    Caché en disco de objetos S3 direccionada por contenido: cada objeto se
+    guarda una sola vez bajo el hash de su ETag y tamaño, y un índice SQLite
+    relaciona (bucket, key, versión) con ese archivo. Las versiones concretas
+    se sirven sin consultar S3; la última versión se valida con un GET
+    condicional (If-None-Match). Los archivos se escriben con renombrados
+    atómicos y el índice admite varios procesos a la vez.
+    """
+
+    def __init__(self, directorio=None, max_bytes=None):
+        self.directorio = directorio or CACHE_DIR
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._dir_objetos = os.path.join(self.directorio, "objetos")
+        os.makedirs(self._dir_objetos, exist_ok=True)
+        with self._conectar() as conexion:
+            conexion.execute("""
+                CREATE TABLE IF NOT EXISTS entradas (
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    version_id TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    blob TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    ultimo_acceso REAL NOT NULL,
+                    PRIMARY KEY (bucket, key, version_id)
+                ) WITHOUT ROWID
+            """)
+            conexion.execute("CREATE INDEX IF NOT EXISTS idx_entradas_blob ON entradas (blob)")
+
+    def _conectar(self):
+        conexion = sqlite3.connect(os.path.join(self.directorio, "indice.sqlite"), timeout=30)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        return conexion
+
+    def _ruta_blob(self, blob):
+        return os.path.join(self._dir_objetos, blob)
+
+    def _buscar(self, bucket_name, key_s3, version_id):
+        with self._conectar() as conexion:
+            return conexion.execute(
+                "SELECT etag, blob FROM entradas WHERE bucket = ? AND key = ? AND version_id = ?",
+                (bucket_name, key_s3, version_id or "")
+            ).fetchone()
+
+    def _registrar(self, bucket_name, key_s3, version_id, etag, blob, tamano):
+        anterior = self._buscar(bucket_name, key_s3, version_id)
+        with self._conectar() as conexion:
+            conexion.execute(
+                "INSERT OR REPLACE INTO entradas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (bucket_name, key_s3, version_id or "", etag, blob, tamano, time.time())
+            )
+            # El contenido sustituido se borra si ya no lo referencia ninguna otra entrada
+            if anterior is not None and anterior[1] != blob and conexion.execute(
+                    "SELECT 1 FROM entradas WHERE blob = ?", (anterior[1],)).fetchone() is None:
+                self._borrar_blob(anterior[1])
+        self._expulsar()
+
+    def _borrar_blob(self, blob):
+        try:
+            os.remove(self._ruta_blob(blob))
+        except FileNotFoundError:
+            pass
+
+    def _tocar(self, bucket_name, key_s3, version_id):
+        with self._conectar() as conexion:
+            conexion.execute(
+                "UPDATE entradas SET ultimo_acceso = ? WHERE bucket = ? AND key = ? AND version_id = ?",
+                (time.time(), bucket_name, key_s3, version_id or "")
+            )
+
+    def _olvidar(self, bucket_name, key_s3, version_id):
+        with self._conectar() as conexion:
+            conexion.execute(
+                "DELETE FROM entradas WHERE bucket = ? AND key = ? AND version_id = ?",
+                (bucket_name, key_s3, version_id or "")
+            )
+
+    def _expulsar(self):
+        """Borra los archivos usados hace más tiempo hasta quedar dentro del presupuesto de bytes."""
+        with self._conectar() as conexion:
+            blobs = conexion.execute("""
+                SELECT blob, MAX(bytes), MAX(ultimo_acceso) AS acceso
+                FROM entradas GROUP BY blob ORDER BY acceso
+            """).fetchall()
+            total = sum(tamano for _, tamano, _ in blobs)
+            for blob, tamano, _ in blobs:
+                if total <= self.max_bytes:
+                    break
+                conexion.execute("DELETE FROM entradas WHERE blob = ?", (blob,))
+                self._borrar_blob(blob)
+                total -= tamano
+
+    def _copiar_a_destino(self, blob, nombre_local):
+        os.makedirs(os.path.dirname(os.path.abspath(nombre_local)), exist_ok=True)
+        temporal = f"{nombre_local}.{os.getpid()}.tmp"
+        with open(self._ruta_blob(blob), "rb") as origen, open(temporal, "wb") as destino:
+            while True:
+                bloque = origen.read(MB)
+                if not bloque:
+                    break
+                destino.write(bloque)
+        os.replace(temporal, nombre_local)
+
+    def _guardar_blob(self, temporal, etag, tamano):
+        blob = hashlib.sha256(f"{etag}:{tamano}".encode()).hexdigest()
+        os.replace(temporal, self._ruta_blob(blob))
+        return blob
+
+    def contiene(self, bucket_name, key_s3, version_id=None):
+        entrada = self._buscar(bucket_name, key_s3, version_id)
+        return entrada is not None and os.path.exists(self._ruta_blob(entrada[1]))
+
+    def descargar(self, s3_client, bucket_name, key_s3, nombre_local, version_id=None, transfer_config=None,
+                  inmutable=False):
+        """
+        Deja el objeto en 'nombre_local' sirviéndolo desde la caché si sigue
+        vigente. Devuelve True si ha sido un acierto y False si se ha descargado.
+        Con inmutable=True (objetos que nunca se reescriben, como los resultados
+        de Athena) no se revalida y sirve aunque ya no exista en S3.
+        """
+        entrada = self._buscar(bucket_name, key_s3, version_id)
+        temporal = os.path.join(self._dir_objetos, f".{os.getpid()}.{threading.get_ident()}.descarga")
+
+        if entrada is not None:
+            etag, blob = entrada
+            try:
+                if version_id is None and not inmutable:
+                    # La versión actual puede haber cambiado: GET condicional sobre el ETag cacheado
+                    response = s3_client.get_object(Bucket=bucket_name, Key=key_s3, IfNoneMatch=etag)
+                    with open(temporal, "wb") as f:
+                        for bloque in response["Body"].iter_chunks(MB):
+                            f.write(bloque)
+                    self._guardar_y_copiar(bucket_name, key_s3, None, response["ETag"],
+                                           response["ContentLength"], temporal, nombre_local)
+                    return False
+            except s3_client.exceptions.ClientError as e:
+                if e.response["Error"]["Code"] not in ("304", "NotModified"):
+                    raise
+            try:
+                self._copiar_a_destino(blob, nombre_local)
+                self._tocar(bucket_name, key_s3, version_id)
+                return True
+            except FileNotFoundError:
+                # Otro proceso lo ha expulsado entre la consulta y la copia
+                self._olvidar(bucket_name, key_s3, version_id)
+
+        head = descargar_objeto_rangos(s3_client, bucket_name, key_s3, temporal,
+                                       version_id=version_id, transfer_config=transfer_config)
+        self._guardar_y_copiar(bucket_name, key_s3, version_id, head["ETag"],
+                               head["ContentLength"], temporal, nombre_local)
+        return False
+
+    def _guardar_y_copiar(self, bucket_name, key_s3, version_id, etag, tamano, temporal, nombre_local):
+        if tamano > self.max_bytes:
+            # No cabe en la caché: se entrega directamente
+            os.replace(temporal, nombre_local)
+            return
+        blob = self._guardar_blob(temporal, etag, tamano)
+        self._registrar(bucket_name, key_s3, version_id, etag, blob, tamano)
+        self._copiar_a_destino(blob, nombre_local)
+
+    def estadisticas(self):
+        with self._conectar() as conexion:
+            entradas, blobs, total = conexion.execute("""
+                SELECT COALESCE(SUM(n), 0), COUNT(*), COALESCE(SUM(bytes), 0)
+                FROM (SELECT blob, COUNT(*) AS n, MAX(bytes) AS bytes FROM entradas GROUP BY blob)
+            """).fetchone()
+        return {"entradas": entradas, "objetos": blobs, "bytes": total, "max_bytes": self.max_bytes}
+
+
+_cache_local = None
+
+
+def obtener_cache_local():
+    """Caché compartida del proceso (None si S3_CACHE_MAX_BYTES=0)."""
+    global _cache_local
+    if _cache_local is None and CACHE_MAX_BYTES > 0:
+        _cache_local = CacheObjetosLocal()
+    return _cache_local
+
+
+def descargar_con_cache(s3_client, bucket_name, key_s3, nombre_local, version_id=None,
+                        transfer_config=None, cache=None):
+    """Descarga usando la caché local (la compartida si no se indica otra) cuando está activa."""
+    cache = cache or obtener_cache_local()
+    if cache is None:
+        descargar_objeto_rangos(s3_client, bucket_name, key_s3, nombre_local,
+                                version_id=version_id, transfer_config=transfer_config)
+        return False
+    return cache.descargar(s3_client, bucket_name, key_s3, nombre_local,
+                           version_id=version_id, transfer_config=transfer_config)
+
+
+# -----------------------------
+# LISTADO PARALELO POR PREFIJOS (buckets con millones de keys)
+# -----------------------------
+# Puntos de corte para repartir un prefijo plano (sin delimitadores) en rangos con StartAfter
+ALFABETO_CORTES = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+def _pagina_listado(s3_client, bucket_name, prefijo, versiones, delimitador=None, inicio=None, continuacion=None):
+    """Pide una página y devuelve (objetos, subprefijos, continuación o None)."""
+    kwargs = {"Bucket": bucket_name, "Prefix": prefijo}
+    if delimitador:
+        kwargs["Delimiter"] = delimitador
+    if versiones:
+        if continuacion:
+            kwargs["KeyMarker"], kwargs["VersionIdMarker"] = continuacion
+        elif inicio:
+            kwargs["KeyMarker"] = inicio
+        pagina = s3_client.list_object_versions(**kwargs)
+        objetos = pagina.get("Versions", []) + [
+            dict(marcador, EsMarcadorBorrado=True) for marcador in pagina.get("DeleteMarkers", [])
+        ]
+        # Por key, de la más reciente a la más antigua como las devuelve S3 (sort estable:
+        # dentro de cada lista se conserva su orden aunque LastModified empate al segundo)
+        objetos.sort(key=lambda obj: (obj["Key"], not obj.get("IsLatest"), -obj["LastModified"].timestamp()))
+        siguiente = (pagina["NextKeyMarker"], pagina.get("NextVersionIdMarker", "")) if pagina.get("IsTruncated") else None
+    else:
+        if continuacion:
+            kwargs["ContinuationToken"] = continuacion
+        elif inicio:
+            kwargs["StartAfter"] = inicio
+        pagina = s3_client.list_objects_v2(**kwargs)
+        objetos = pagina.get("Contents", [])
+        siguiente = pagina.get("NextContinuationToken") if pagina.get("IsTruncated") else None
+    subprefijos = [p["Prefix"] for p in pagina.get("CommonPrefixes", [])]
+    return objetos, subprefijos, siguiente
+
+
+def listar_paralelo(s3_client, bucket_name, prefijo="", versiones=False, delimitador="/", profundidad=2,
+                    max_workers=16, max_pendientes=10000):
+    """
+    Recorre el prefijo repartiéndolo en fragmentos que se paginan en paralelo y
+    devuelve los objetos (o versiones y marcadores de borrado) en un único
+    iterador, sin orden global. Hasta 'profundidad' niveles se descubren los
+    subprefijos con el delimitador; si un prefijo no tiene subprefijos y no cabe
+    en una página, se trocea en rangos de keys con StartAfter/KeyMarker.
+    """
+    cola = queue.Queue(maxsize=max_pendientes)  # contrapresión si el consumidor va más lento
+    cancelado = threading.Event()
+    lock = threading.Lock()
+    pendientes = [0]
+    futures = []
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def emitir(elemento):
+        while not cancelado.is_set():
+            try:
+                cola.put(elemento, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def lanzar(funcion, *args):
+        with lock:
+            pendientes[0] += 1
+            futures.append(executor.submit(ejecutar, funcion, *args))
+
+    def ejecutar(funcion, *args):
+        try:
+            if not cancelado.is_set():
+                funcion(*args)
+        except Exception as e:
+            emitir(("error", e))
+        finally:
+            with lock:
+                pendientes[0] -= 1
+                terminado = pendientes[0] == 0
+            if terminado:
+                emitir(("fin", None))
+
+    def recorrer(prefijo_actual, nivel, inicio=None, fin=None, continuacion=None):
+        usar_delimitador = delimitador if nivel < profundidad and inicio is None else None
+        primera = True
+        while not cancelado.is_set():
+            objetos, subprefijos, continuacion = _pagina_listado(
+                s3_client, bucket_name, prefijo_actual, versiones,
+                delimitador=usar_delimitador, inicio=inicio, continuacion=continuacion
+            )
+            for subprefijo in subprefijos:
+                lanzar(recorrer, subprefijo, nivel + 1)
+            for obj in objetos:
+                if fin is not None and obj["Key"] > fin:
+                    return
+                emitir(("objeto", obj))
+            if continuacion is None:
+                return
+            if primera and not subprefijos and inicio is None and fin is None and objetos:
+                # Prefijo plano y grande: el resto se reparte en rangos de keys
+                # (el primer rango sigue desde la continuación para no perder versiones de la última key)
+                ultima = objetos[-1]["Key"]
+                cortes = [c for c in (prefijo_actual + letra for letra in ALFABETO_CORTES) if c > ultima]
+                limites = [ultima] + cortes
+                for i, desde in enumerate(limites):
+                    hasta = limites[i + 1] if i + 1 < len(limites) else None
+                    lanzar(recorrer, prefijo_actual, profundidad, desde, hasta, continuacion if i == 0 else None)
+                return
+            primera = False
+
+    lanzar(recorrer, prefijo, 0)
+    try:
+        while True:
+            tipo, valor = cola.get()
+            if tipo == "fin":
+                return
+            if tipo == "error":
+                raise valor
+            yield valor
+    finally:
+        cancelado.set()
+        # Los fragmentos aún en cola no llegan a listar (cancel_futures no existe en Python 3.8)
+        with lock:
+            for future in futures:
+                future.cancel()
+        executor.shutdown(wait=False)
+
+
+def resumir_listado(objetos):
+    """Agrega número de objetos y bytes, en total y por clase de almacenamiento."""
+    resumen = {"objetos": 0, "bytes": 0, "por_clase": {}}
+    for obj in objetos:
+        if obj.get("EsMarcadorBorrado"):
+            continue
+        clase = obj.get("StorageClass", "STANDARD")
+        por_clase = resumen["por_clase"].setdefault(clase, {"objetos": 0, "bytes": 0})
+        for destino in (resumen, por_clase):
+            destino["objetos"] += 1
+            destino["bytes"] += obj.get("Size", 0)
+    return resumen
 
 
 # -----------------------------
@@ -36,7 +892,8 @@ def crear_bucket(s3_client, bucket_name):
 def crear_csv_local(nombre_archivo):
     print(f"🔹 [3/6] Creando archivo CSV local '{nombre_archivo}'...")
     with open(nombre_archivo, mode="w", newline="") as file:
-        writer = csv.writer(file)
+        # Saltos de línea "\n": S3 Select solo admite un carácter como separador de registros
+        writer = csv.writer(file, lineterminator="\n")
         writer.writerow(["id", "nombre", "edad"])
         writer.writerow([1, "Ana", 30])
         writer.writerow([2, "Luis", 25])
@@ -44,31 +901,65 @@ def crear_csv_local(nombre_archivo):
     print("✅ Archivo CSV creado\n")
 
 
-def subir_csv_a_carpetas(s3_client, bucket_name, archivo_csv, carpetas):
+def subir_csv_a_carpetas(s3_client, bucket_name, archivo_csv, carpetas, transfer_config=None,
+                         fan_out=False, max_workers=8):
+    """
+    Sube el CSV a cada carpeta. Con fan_out=True se sube una sola vez desde el
+    cliente y el resto de carpetas se rellenan con copias en el servidor (en paralelo).
+    """
     print("🔹 [4/6] Subiendo CSV a carpetas de S3...")
-    for carpeta in carpetas:
-        print(f"   ⤴ Subiendo a '{carpeta}/'...")
-        s3_client.upload_file(
-            Filename=archivo_csv,
-            Bucket=bucket_name,
-            Key=f"{carpeta}/{archivo_csv}"
-        )
+    if not fan_out or len(carpetas) < 2:
+        for carpeta in carpetas:
+            print(f"   ⤴ Subiendo a '{carpeta}/'...")
+            s3_client.upload_file(
+                Filename=archivo_csv,
+                Bucket=bucket_name,
+                Key=f"{carpeta}/{archivo_csv}",
+                Config=obtener_transfer_config(transfer_config)
+            )
+        print("✅ Archivos subidos correctamente\n")
+        return
+
+    key_origen = f"{carpetas[0]}/{archivo_csv}"
+    print(f"   ⤴ Subiendo a '{carpetas[0]}/'...")
+    s3_client.upload_file(
+        Filename=archivo_csv,
+        Bucket=bucket_name,
+        Key=key_origen,
+        Config=obtener_transfer_config(transfer_config)
+    )
+
+    tamano = os.path.getsize(archivo_csv)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                copiar_objeto, s3_client, bucket_name, key_origen, f"{carpeta}/{archivo_csv}",
+                tamano=tamano, transfer_config=transfer_config
+            ): carpeta
+            for carpeta in carpetas[1:]
+        }
+        for future, carpeta in futures.items():
+            future.result()
+            print(f"   ⧉ Copiado en el servidor a '{carpeta}/'")
     print("✅ Archivos subidos correctamente\n")
 
 
-def descargar_objeto(s3_client, bucket_name, key_s3, nombre_local):
+def descargar_objeto(s3_client, bucket_name, key_s3, nombre_local, transfer_config=None):
     print(f"🔹 [5/6] Descargando objeto '{key_s3}'...")
-    s3_client.download_file(
-        Bucket=bucket_name,
-        Key=key_s3,
-        Filename=nombre_local
+    desde_cache = descargar_con_cache(
+        s3_client,
+        bucket_name,
+        key_s3,
+        nombre_local,
+        transfer_config=transfer_config
     )
-    print(f"✅ Archivo descargado como '{nombre_local}'\n")
+    origen = " (desde caché local)" if desde_cache else ""
+    print(f"✅ Archivo descargado como '{nombre_local}'{origen}\n")
 
 # -----------------------------
 # EJERCICIO 5: S3 Standard - Acceso poco frecuente (STANDARD_IA)
 # -----------------------------
-def subir_objeto_standard_ia(s3_client, bucket_name, archivo_local, key_s3):
+def subir_objeto_standard_ia(s3_client, bucket_name, archivo_local, key_s3, transfer_config=None):
     print("🔹 [3/5] Subiendo objeto con clase STANDARD_IA...")
 
     s3_client.upload_file(
@@ -77,7 +968,8 @@ def subir_objeto_standard_ia(s3_client, bucket_name, archivo_local, key_s3):
         Key=key_s3,
         ExtraArgs={
             "StorageClass": "STANDARD_IA"
-        }
+        },
+        Config=obtener_transfer_config(transfer_config)
     )
 
     print("✅ Objeto subido en clase STANDARD_IA\n")
@@ -86,7 +978,7 @@ def subir_objeto_standard_ia(s3_client, bucket_name, archivo_local, key_s3):
 # -----------------------------
 # EJERCICIO 6: S3 Intelligent-Tiering
 # -----------------------------
-def subir_objeto_intelligent_tiering(s3_client, bucket_name, archivo_local, key_s3):
+def subir_objeto_intelligent_tiering(s3_client, bucket_name, archivo_local, key_s3, transfer_config=None):
     print("🔹 [3/5] Subiendo objeto con clase INTELLIGENT_TIERING...")
 
     s3_client.upload_file(
@@ -95,7 +987,8 @@ def subir_objeto_intelligent_tiering(s3_client, bucket_name, archivo_local, key_
         Key=key_s3,
         ExtraArgs={
             "StorageClass": "INTELLIGENT_TIERING"
-        }
+        },
+        Config=obtener_transfer_config(transfer_config)
     )
 
     print("✅ Objeto subido en clase INTELLIGENT_TIERING\n")
@@ -103,7 +996,7 @@ def subir_objeto_intelligent_tiering(s3_client, bucket_name, archivo_local, key_
 # -----------------------------
 # EJERCICIO 7: S3 Glacier
 # -----------------------------
-def subir_objeto_glacier(s3_client, bucket_name, archivo_local, key_s3):
+def subir_objeto_glacier(s3_client, bucket_name, archivo_local, key_s3, transfer_config=None):
     print("🔹 [3/6] Subiendo objeto con clase GLACIER...")
 
     s3_client.upload_file(
@@ -112,55 +1005,49 @@ def subir_objeto_glacier(s3_client, bucket_name, archivo_local, key_s3):
         Key=key_s3,
         ExtraArgs={
             "StorageClass": "GLACIER"
-        }
+        },
+        Config=obtener_transfer_config(transfer_config)
     )
 
     print("✅ Objeto subido en GLACIER\n")
 
-def restaurar_objeto_glacier(s3_client, bucket_name, key_s3):
+def restaurar_objeto_glacier(s3_client, bucket_name, key_s3, dias=1, tier="Standard"):
     print("🔹 [4/6] Solicitando restauración del objeto Glacier...")
 
     s3_client.restore_object(
         Bucket=bucket_name,
         Key=key_s3,
         RestoreRequest={
-            "Days": 1,
+            "Days": dias,
             "GlacierJobParameters": {
-                "Tier": "Standard"  # puede ser Expedited | Standard | Bulk
+                "Tier": tier  # puede ser Expedited | Standard | Bulk
             }
         }
     )
 
     print("⏳ Restauración solicitada (puede tardar minutos u horas)\n")
 
-def comprobar_restauracion(s3_client, bucket_name, key_s3, wait_interval=60):
+def comprobar_restauracion(s3_client, bucket_name, key_s3, wait_interval=60, max_wait_seconds=None):
     """
-    Comprueba el estado de restauración de un objeto Glacier y espera
-    hasta que esté disponible para descargar.
+    Comprueba el estado de restauración de un objeto Glacier / Deep Archive y
+    espera hasta que esté disponible para descargar (con backoff adaptativo a
+    partir de wait_interval). Lanza TimeoutError si se supera max_wait_seconds
+    y FileNotFoundError si el objeto no existe.
     """
     print("🔹 [5/6] Comprobando estado de restauración...")
-
-    while True:
-        response = s3_client.head_object(Bucket=bucket_name, Key=key_s3)
-        restore_status = response.get("Restore")
-
-        if restore_status:
-            # Cuando 'ongoing-request="false"' significa que ya está restaurado
-            if 'ongoing-request="false"' in restore_status:
-                print("✅ Objeto restaurado y listo para descargar\n")
-                break
-            else:
-                print(f"⏳ Objeto en Glacier, esperando restauración... ({restore_status})")
-        else:
-            print("⏳ Objeto aún no tiene restauración iniciada...")
-
-        time.sleep(wait_interval)  # espera antes de revisar de nuevo
+    desaparecidas = []
+    for _ in seguir_restauraciones(s3_client, bucket_name, [key_s3], intervalo_min=wait_interval,
+                                   max_wait_seconds=max_wait_seconds, desaparecidas=desaparecidas):
+        print("✅ Objeto restaurado y listo para descargar\n")
+    if desaparecidas:
+        raise FileNotFoundError(f"'{key_s3}' no existe en el bucket '{bucket_name}'")
+    return True
 
 
 # -----------------------------
 # EJERCICIO 8: S3 Glacier Deep Archive
 # -----------------------------
-def subir_objeto_deep_archive(s3_client, bucket_name, archivo_local, key_s3):
+def subir_objeto_deep_archive(s3_client, bucket_name, archivo_local, key_s3, transfer_config=None):
     print("🔹 [3/6] Subiendo objeto con clase DEEP_ARCHIVE...")
 
     s3_client.upload_file(
@@ -169,59 +1056,394 @@ def subir_objeto_deep_archive(s3_client, bucket_name, archivo_local, key_s3):
         Key=key_s3,
         ExtraArgs={
             "StorageClass": "DEEP_ARCHIVE"
-        }
+        },
+        Config=obtener_transfer_config(transfer_config)
     )
 
     print("✅ Objeto subido en DEEP_ARCHIVE\n")
 
-def restaurar_objeto_deep_archive(s3_client, bucket_name, key_s3):
+def restaurar_objeto_deep_archive(s3_client, bucket_name, key_s3, dias=1, tier="Standard"):
     print("🔹 [4/6] Solicitando restauración del objeto Deep Archive...")
 
     s3_client.restore_object(
         Bucket=bucket_name,
         Key=key_s3,
         RestoreRequest={
-            "Days": 1,
+            "Days": dias,
             "GlacierJobParameters": {
-                "Tier": "Standard"
+                "Tier": tier  # Standard | Bulk (Deep Archive no admite Expedited)
             }
         }
     )
 
     print("⏳ Restauración solicitada (puede tardar muchas horas)\n")
 
-def comprobar_restauracion(s3_client, bucket_name, key_s3, wait_interval=60, max_wait_seconds=None):
-    print("🔹 [5/6] Comprobando estado de restauración...")
+# -----------------------------
+# RESTAURACIÓN MASIVA Y SEGUIMIENTO (Glacier / Deep Archive)
+# -----------------------------
+# Tiempos máximos orientativos (horas) por tier, del más barato al más rápido
+TIERS_RESTAURACION = {
+    "GLACIER": [("Bulk", 12), ("Standard", 5), ("Expedited", 5 / 60)],
+    "DEEP_ARCHIVE": [("Bulk", 48), ("Standard", 12)],
+}
+# Expedited solo está pensado para objetos de hasta 250 MB
+MAX_BYTES_EXPEDITED = 250 * MB
 
-    elapsed = 0
-    while True:
-        try:
-            response = s3_client.head_object(Bucket=bucket_name, Key=key_s3)
-        except Exception as e:
-            print(f"Error al consultar objeto: {e}. Reintentando en {wait_interval}s...")
-            if max_wait_seconds is not None and elapsed >= max_wait_seconds:
-                raise TimeoutError(f"Timeout tras {max_wait_seconds}s al comprobar restauración")
-            time.sleep(wait_interval)
-            elapsed += wait_interval
+
+def elegir_tier(clase, tamano, plazo_horas=None):
+    """Elige el tier más barato que termina dentro del plazo (o el más rápido posible si ninguno llega)."""
+    if plazo_horas is None:
+        return "Standard"
+    tiers = [
+        (tier, horas) for tier, horas in TIERS_RESTAURACION.get(clase, TIERS_RESTAURACION["GLACIER"])
+        if tier != "Expedited" or tamano <= MAX_BYTES_EXPEDITED
+    ]
+    for tier, horas in tiers:
+        if horas <= plazo_horas:
+            return tier
+    return tiers[-1][0]
+
+
+def _objetos_archivados(s3_client, bucket_name, prefijo=None, keys=None, max_workers=16):
+    """Devuelve [(key, clase, tamaño)] de los objetos que necesitan restauración."""
+    if keys is None:
+        objetos = [
+            (obj["Key"], obj.get("StorageClass", "STANDARD"), obj["Size"])
+            for obj in listar_paralelo(s3_client, bucket_name, prefijo or "", max_workers=max_workers)
+        ]
+    else:
+        def head(key):
+            response = s3_client.head_object(Bucket=bucket_name, Key=key)
+            return key, response.get("StorageClass", "STANDARD"), response["ContentLength"]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            objetos = list(executor.map(head, keys))
+    return [obj for obj in objetos if obj[1] in TIERS_RESTAURACION]
+
+
+def restaurar_masivo(s3_client, bucket_name, prefijo=None, keys=None, dias=1, plazo_horas=None,
+                     max_workers=16, max_por_segundo=None):
+    """
+    Solicita la restauración de todos los objetos GLACIER/DEEP_ARCHIVE de un
+    prefijo (o de una lista de keys) en paralelo y con límite de peticiones por
+    segundo. El tier se elige por objeto según su tamaño y el plazo indicado.
+    Las restauraciones ya en curso no se consideran error.
+    """
+    print("🔹 Solicitando restauración masiva...")
+    objetos = _objetos_archivados(s3_client, bucket_name, prefijo, keys, max_workers)
+    total = len(objetos)
+    limitador = TokenBucket(max_por_segundo)
+    resumen = {"solicitadas": 0, "en_curso": 0, "ya_restauradas": 0, "errores": {}, "por_tier": {}}
+    lock = threading.Lock()
+    hechas = [0]
+
+    def restaurar(objeto):
+        key, clase, tamano = objeto
+        tier = elegir_tier(clase, tamano, plazo_horas)
+        while True:
+            limitador.acquire()
+            try:
+                response = s3_client.restore_object(
+                    Bucket=bucket_name,
+                    Key=key,
+                    RestoreRequest={"Days": dias, "GlacierJobParameters": {"Tier": tier}}
+                )
+                # 200: ya existía una copia restaurada (solo se amplía su expiración); 202: aceptada
+                resultado = "ya_restauradas" if response["ResponseMetadata"]["HTTPStatusCode"] == 200 else "solicitadas"
+                break
+            except s3_client.exceptions.ClientError as e:
+                codigo = e.response["Error"]["Code"]
+                if codigo == "RestoreAlreadyInProgress":
+                    resultado = "en_curso"
+                    break
+                if codigo == "GlacierExpeditedRetrievalNotAvailable" and tier == "Expedited":
+                    tier = "Standard"  # sin capacidad Expedited: se reintenta con Standard
+                    continue
+                with lock:
+                    resumen["errores"][key] = codigo
+                resultado = None
+                break
+
+        with lock:
+            if resultado:
+                resumen[resultado] += 1
+                resumen["por_tier"][tier] = resumen["por_tier"].get(tier, 0) + 1
+            hechas[0] += 1
+            if hechas[0] == total or hechas[0] % max(1, total // 20) == 0:
+                print(f"   ⏳ {hechas[0]}/{total} objetos procesados ({100 * hechas[0] // total}%)")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(restaurar, objetos))
+
+    print(
+        f"✅ Restauración masiva: {resumen['solicitadas']} solicitadas, {resumen['en_curso']} ya en curso, "
+        f"{resumen['ya_restauradas']} ya restauradas, {len(resumen['errores'])} errores\n"
+    )
+    return resumen
+
+
+def _clave_anterior(key):
+    """Cadena justo anterior a 'key' en orden de S3, para usarla como StartAfter sin saltarse 'key'."""
+    if not key:
+        return ""
+    ultimo = ord(key[-1])
+    return key[:-1] + (chr(ultimo - 1) + "\U0010ffff" if ultimo else "")
+
+
+def _restaurada(clase, estado_lista=None, cabecera_restore=None):
+    if clase not in TIERS_RESTAURACION:
+        return True
+    if estado_lista is not None:
+        return not estado_lista.get("IsRestoreInProgress", True)
+    return cabecera_restore is not None and 'ongoing-request="false"' in cabecera_restore
+
+
+def _consultar_restauraciones(s3_client, bucket_name, pendientes, dispersos=None):
+    """
+    Devuelve (restauradas, desaparecidas) para las keys pendientes usando
+    list_objects_v2 con RestoreStatus: hasta 1000 keys por petición en vez de
+    un head_object por key. Cada grupo (misma carpeta) se lista desde justo
+    antes de su primera key hasta su última. Si el recorrido necesita más
+    páginas que keys quedan por comprobar (keys muy separadas en una carpeta
+    grande), el resto se consulta con head_object; esos grupos se anotan en
+    'dispersos' para ir directamente a head_object en las siguientes consultas.
+    """
+    dispersos = set() if dispersos is None else dispersos
+    grupos = {}
+    for key in pendientes:
+        grupos.setdefault(key.rsplit("/", 1)[0] if "/" in key else "", []).append(key)
+
+    restauradas, vistas = set(), set()
+    por_head = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for grupo, keys in grupos.items():
+        if grupo in dispersos:
+            por_head.extend(keys)
             continue
+        buscadas = set(keys)
+        ultima = max(keys)
+        paginas = paginator.paginate(
+            Bucket=bucket_name,
+            Prefix=os.path.commonprefix(keys),
+            StartAfter=_clave_anterior(min(keys)),
+            OptionalObjectAttributes=["RestoreStatus"]
+        )
+        for numero, pagina in enumerate(paginas, start=1):
+            contenido = pagina.get("Contents", [])
+            for obj in contenido:
+                if obj["Key"] not in buscadas:
+                    continue
+                vistas.add(obj["Key"])
+                buscadas.discard(obj["Key"])
+                if _restaurada(obj.get("StorageClass"), estado_lista=obj.get("RestoreStatus", {})):
+                    restauradas.add(obj["Key"])
+            if not contenido or contenido[-1]["Key"] >= ultima or not buscadas:
+                break
+            if numero >= len(buscadas):
+                # Listar sale más caro que un HEAD por key pendiente
+                dispersos.add(grupo)
+                por_head.extend(k for k in buscadas if k > contenido[-1]["Key"])
+                break
+
+    def head(key):
+        try:
+            response = s3_client.head_object(Bucket=bucket_name, Key=key)
+        except s3_client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return key, None
+            raise
+        return key, _restaurada(response.get("StorageClass"), cabecera_restore=response.get("Restore"))
 
-        restore_status = response.get("Restore")
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for key, restaurada in executor.map(head, por_head):
+            if restaurada is None:
+                continue
+            vistas.add(key)
+            if restaurada:
+                restauradas.add(key)
+    return restauradas, set(pendientes) - vistas
 
-        if restore_status:
-            # Cuando 'ongoing-request="false"' significa que ya está restaurado
-            if 'ongoing-request="false"' in restore_status:
-                print("✅ Objeto restaurado y listo para descargar\n")
-                return True
-            else:
-                print(f"⏳ Objeto en restauración... ({restore_status})")
-        else:
-            print("⏳ Restauración no iniciada o en cola...")
 
-        if max_wait_seconds is not None and elapsed >= max_wait_seconds:
-            raise TimeoutError(f"Timeout tras {max_wait_seconds}s esperando restauración")
+def seguir_restauraciones(s3_client, bucket_name, keys, intervalo_min=30, intervalo_max=None,
+                          factor=1.5, max_wait_seconds=None, desaparecidas=None):
+    """
+    Generador que vigila muchas restauraciones a la vez y produce cada key en
+    cuanto está disponible, para poder empezar a descargarla mientras el resto
+    sigue en curso. El intervalo crece (x factor) mientras no hay novedades y
+    vuelve a intervalo_min cuando termina alguna restauración. Las keys que no
+    existen se dejan de vigilar y se añaden a la lista 'desaparecidas' si se pasa.
+    """
+    pendientes = set(keys)
+    dispersos = set()  # carpetas donde sale más barato un HEAD por key que listar
+    intervalo_max = intervalo_max or intervalo_min * 15
+    intervalo = intervalo_min
+    inicio = time.monotonic()
+
+    while pendientes:
+        restauradas, no_existen = _consultar_restauraciones(s3_client, bucket_name, pendientes, dispersos)
+        for key in sorted(no_existen):
+            print(f"⚠ '{key}' no existe en el bucket, se deja de vigilar")
+            if desaparecidas is not None:
+                desaparecidas.append(key)
+        pendientes -= restauradas | no_existen
+        for key in sorted(restauradas):
+            yield key
+        if not pendientes:
+            return
+
+        intervalo = intervalo_min if restauradas else min(intervalo_max, intervalo * factor)
+        transcurrido = time.monotonic() - inicio
+        if max_wait_seconds is not None and transcurrido >= max_wait_seconds:
+            raise TimeoutError(f"Timeout tras {max_wait_seconds}s esperando restauración de {len(pendientes)} objetos")
+        if max_wait_seconds is not None:
+            intervalo = min(intervalo, max_wait_seconds - transcurrido)
+        print(f"⏳ {len(pendientes)} objetos en restauración, nueva comprobación en {intervalo:.0f}s...")
+        time.sleep(intervalo)
+
+
+# -----------------------------
+# MIGRACIÓN DE CLASE DE ALMACENAMIENTO (copias en el servidor)
+# -----------------------------
+def migrar_clase_almacenamiento(s3_client, bucket_name, prefijo, clase_destino, max_workers=16,
+                                max_por_segundo=None, checkpoint=None, transfer_config=None):
+    """
+    Cambia la clase de almacenamiento de todos los objetos de un prefijo
+    copiándolos sobre sí mismos en el servidor (sin descargar nada) y
+    conservando metadatos y etiquetas. Procesa página a página (1000 objetos)
+    y guarda la última key completada en el checkpoint para poder reanudar;
+    al reanudar se reintentan primero los objetos que fallaron.
+    """
+    print(f"🔹 Migrando s3://{bucket_name}/{prefijo} a {clase_destino}...")
+    checkpoint = checkpoint or f"migracion_{bucket_name}_{clase_destino}.checkpoint.json"
+    estado = _cargar_manifiesto(checkpoint)
+    if estado.get("prefijo") != prefijo:
+        estado = {"prefijo": prefijo, "ultima_key": None, "migrados": 0, "omitidos": 0, "errores": {}}
+    elif estado.get("ultima_key"):
+        print(f"   ↻ Reanudando tras '{estado['ultima_key']}' ({estado['migrados']} ya migrados)")
+
+    limitador = TokenBucket(max_por_segundo)
+
+    def migrar(obj):
+        limitador.acquire()
+        try:
+            copiar_objeto(
+                s3_client, bucket_name, obj["Key"], obj["Key"], tamano=obj["Size"],
+                extra_args={"StorageClass": clase_destino},
+                transfer_config=transfer_config
+            )
+            return obj["Key"], None
+        except s3_client.exceptions.ClientError as e:
+            return obj["Key"], e.response["Error"]["Code"]
+
+    def reintentar(key):
+        try:
+            head = s3_client.head_object(Bucket=bucket_name, Key=key)
+        except s3_client.exceptions.ClientError as e:
+            codigo = e.response["Error"]["Code"]
+            return key, None if codigo in ("404", "NoSuchKey", "NotFound") else codigo, False
+        if head.get("StorageClass", "STANDARD") == clase_destino:
+            return key, None, False
+        key, error = migrar({"Key": key, "Size": head["ContentLength"]})
+        return key, error, error is None
+
+    kwargs = {"Bucket": bucket_name, "Prefix": prefijo}
+    if estado["ultima_key"]:
+        kwargs["StartAfter"] = estado["ultima_key"]
+
+    paginator = s3_client.get_paginator("list_objects_v2")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Al reanudar, las keys que fallaron quedan antes del checkpoint: se reintentan primero
+        if estado["errores"]:
+            print(f"   ↻ Reintentando {len(estado['errores'])} objetos que fallaron")
+            for key, error, migrado in executor.map(reintentar, list(estado["errores"])):
+                if error:
+                    estado["errores"][key] = error
+                else:
+                    del estado["errores"][key]
+                    estado["migrados"] += int(migrado)
+            _guardar_json_atomico(checkpoint, estado)
+
+        for pagina in paginator.paginate(**kwargs):
+            contenido = pagina.get("Contents", [])
+            if not contenido:
+                continue
+            # Los archivados necesitan restauración previa y los ya migrados no se tocan
+            candidatos = [
+                obj for obj in contenido
+                if obj.get("StorageClass", "STANDARD") not in TIERS_RESTAURACION
+                and obj.get("StorageClass", "STANDARD") != clase_destino
+            ]
+            for key, error in executor.map(migrar, candidatos):
+                if error:
+                    estado["errores"][key] = error
+                else:
+                    estado["migrados"] += 1
+            estado["omitidos"] += len(contenido) - len(candidatos)
+            estado["ultima_key"] = contenido[-1]["Key"]
+            _guardar_json_atomico(checkpoint, estado)
+            print(f"   ⏳ {estado['migrados']} migrados, {estado['omitidos']} omitidos (hasta '{estado['ultima_key']}')")
+
+    if not estado["errores"] and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    print(
+        f"✅ Migración a {clase_destino} completada: {estado['migrados']} migrados, "
+        f"{estado['omitidos']} omitidos, {len(estado['errores'])} errores\n"
+    )
+    return estado
+
+
+# -----------------------------
+# BORRADO MASIVO (DeleteObjects en lotes de 1000)
+# -----------------------------
+MAX_KEYS_DELETE = 1000
+
+
+def _lotes_a_borrar(s3_client, bucket_name, prefijo, versiones):
+    """Genera lotes de hasta 1000 identificadores (con VersionId si versiones=True) a medida que se lista."""
+    lote = []
+    for obj in listar_paralelo(s3_client, bucket_name, prefijo, versiones=versiones):
+        lote.append({"Key": obj["Key"], "VersionId": obj["VersionId"]} if versiones else {"Key": obj["Key"]})
+        if len(lote) == MAX_KEYS_DELETE:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def eliminar_prefijo(s3_client, bucket_name, prefijo, versiones=False, max_workers=4):
+    """
+    Borra todos los objetos de un prefijo recorriendo todas las páginas y
+    enviando DeleteObjects de 1000 keys desde varios hilos en paralelo. Con
+    versiones=True borra también todas las versiones y marcadores de borrado.
+    """
+    eliminados = 0
+    errores = []
+    huecos = threading.BoundedSemaphore(max_workers * 2)  # lotes en vuelo: memoria acotada
+
+    def borrar(lote):
+        try:
+            response = s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": lote, "Quiet": True}
+            )
+            return len(lote), response.get("Errors", [])
+        finally:
+            huecos.release()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for lote in _lotes_a_borrar(s3_client, bucket_name, prefijo, versiones):
+            huecos.acquire()
+            futures.append(executor.submit(borrar, lote))
+        for future in futures:
+            total, errores_lote = future.result()
+            eliminados += total - len(errores_lote)
+            errores.extend(errores_lote)
+
+    for error in errores[:10]:
+        print(f"   ⚠ No se pudo borrar '{error['Key']}': {error.get('Code')} {error.get('Message', '')}")
+    return {"eliminados": eliminados, "errores": errores}
 
-        time.sleep(wait_interval)
-        elapsed += wait_interval
 
 # -----------------------------
 # EJERCICIO 9: Versionado en S3
@@ -238,14 +1460,31 @@ def activar_versionado(s3_client, bucket_name):
 
     print("✅ Versionado activado\n")
 
-def subir_objeto_con_version(s3_client, bucket_name, archivo_local, key_s3):
+def subir_objeto_con_version(s3_client, bucket_name, archivo_local, key_s3, solo_si_cambia=False):
+    """
+    Sube el archivo creando una nueva versión. Con solo_si_cambia=True no se
+    crea versión si el objeto actual ya tiene el mismo contenido (ETag = MD5).
+    """
+    if solo_si_cambia:
+        try:
+            actual = s3_client.head_object(Bucket=bucket_name, Key=key_s3)
+        except s3_client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            actual = None
+        md5 = calcular_hashes(archivo_local)["md5"]
+        if actual is not None and actual["ETag"] == f'"{md5}"':
+            print(f"⏭ '{key_s3}' sin cambios, no se crea nueva versión\n")
+            return actual.get("VersionId")
+
     print(f"🔹 Subiendo objeto '{key_s3}'...")
 
-    response = s3_client.put_object(
-        Bucket=bucket_name,
-        Key=key_s3,
-        Body=open(archivo_local, "rb")
-    )
+    with open(archivo_local, "rb") as body:
+        response = s3_client.put_object(
+            Bucket=bucket_name,
+            Key=key_s3,
+            Body=body
+        )
 
     version_id = response.get("VersionId")
     print(f"✅ Subido con VersionId: {version_id}\n")
@@ -255,14 +1494,559 @@ def subir_objeto_con_version(s3_client, bucket_name, archivo_local, key_s3):
 def listar_versiones(s3_client, bucket_name, key_s3):
     print("🔹 [5/6] Listando versiones del objeto...")
 
-    response = s3_client.list_object_versions(
+    paginator = s3_client.get_paginator("list_object_versions")
+    for pagina in paginator.paginate(Bucket=bucket_name, Prefix=key_s3):
+        for v in pagina.get("Versions", []):
+            print(f"VersionId: {v['VersionId']} | Última: {v['IsLatest']}")
+
+    print("✅ Versiones listadas\n")
+
+
+# -----------------------------
+# ÍNDICE DE VERSIONES Y SNAPSHOTS EN EL TIEMPO
+# -----------------------------
+def _a_epoch(instante):
+    """Convierte datetime (naive = UTC) o texto ISO 8601 a segundos epoch."""
+    if isinstance(instante, str):
+        instante = datetime.fromisoformat(instante.replace("Z", "+00:00"))
+    if instante.tzinfo is None:
+        instante = instante.replace(tzinfo=timezone.utc)
+    return instante.timestamp()
+
+
+def _abrir_indice_versiones(ruta_indice):
+    conexion = sqlite3.connect(ruta_indice)
+    conexion.execute("""
+        CREATE TABLE IF NOT EXISTS versiones (
+            bucket TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version_id TEXT NOT NULL,
+            last_modified REAL NOT NULL,
+            es_marcador INTEGER NOT NULL,
+            es_ultima INTEGER NOT NULL,
+            tamano INTEGER,
+            etag TEXT,
+            secuencia INTEGER,
+            PRIMARY KEY (bucket, key, version_id)
+        ) WITHOUT ROWID
+    """)
+    columnas = {fila[1] for fila in conexion.execute("PRAGMA table_info(versiones)")}
+    if "secuencia" not in columnas:
+        # Índices creados antes de guardar el orden del listado (hay que reindexar)
+        conexion.execute("ALTER TABLE versiones ADD COLUMN secuencia INTEGER")
+    conexion.execute("CREATE INDEX IF NOT EXISTS idx_versiones_tiempo ON versiones (bucket, key, last_modified)")
+    return conexion
+
+
+def indexar_versiones(s3_client, bucket_name, prefijo="", ruta_indice=None):
+    """
+    Recorre list_object_versions del prefijo con el listado paralelo (versiones
+    y marcadores de borrado) y las guarda en un índice SQLite en disco en lotes
+    de 1000, sin mantener el listado completo en memoria. Cada versión guarda
+    su posición en el listado ('secuencia'): las versiones de una key llegan de
+    la más reciente a la más antigua, y LastModified solo tiene resolución de
+    segundos.
+    """
+    ruta_indice = ruta_indice or f"versiones_{bucket_name}.sqlite"
+    print(f"🔹 Indexando versiones de s3://{bucket_name}/{prefijo} en '{ruta_indice}'...")
+    conexion = _abrir_indice_versiones(ruta_indice)
+    total = 0
+    with conexion:
+        # Reindexar el prefijo completo: se eliminan versiones que ya no existen
+        conexion.execute(
+            "DELETE FROM versiones WHERE bucket = ? AND substr(key, 1, ?) = ?",
+            (bucket_name, len(prefijo), prefijo)
+        )
+        filas = []
+        # Cada key la recorre un único fragmento del listado, así que su orden se conserva
+        for secuencia, v in enumerate(listar_paralelo(s3_client, bucket_name, prefijo, versiones=True)):
+            es_marcador = v.get("EsMarcadorBorrado", False)
+            filas.append((
+                bucket_name, v["Key"], v["VersionId"], v["LastModified"].timestamp(), int(es_marcador),
+                int(v["IsLatest"]), None if es_marcador else v["Size"], None if es_marcador else v.get("ETag"),
+                secuencia
+            ))
+            if len(filas) == 1000:
+                conexion.executemany("INSERT OR REPLACE INTO versiones VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", filas)
+                total += len(filas)
+                filas = []
+        conexion.executemany("INSERT OR REPLACE INTO versiones VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", filas)
+        total += len(filas)
+    conexion.close()
+    print(f"✅ {total} versiones indexadas\n")
+    return ruta_indice
+
+
+def estado_en(ruta_indice, bucket_name, prefijo, instante):
+    """
+    Devuelve {key: {"VersionId", "Size", "ETag"}} con el contenido del prefijo
+    en el instante indicado: la última versión anterior o igual a ese momento
+    de cada key, omitiendo las que entonces estaban borradas.
+    """
+    conexion = _abrir_indice_versiones(ruta_indice)
+    filas = conexion.execute("""
+        SELECT key, version_id, es_marcador, tamano, etag FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY key ORDER BY last_modified DESC, secuencia
+            ) AS orden
+            FROM versiones
+            WHERE bucket = ? AND substr(key, 1, ?) = ? AND last_modified <= ?
+        ) WHERE orden = 1
+    """, (bucket_name, len(prefijo), prefijo, _a_epoch(instante))).fetchall()
+    conexion.close()
+    return {
+        key: {"VersionId": version_id, "Size": tamano, "ETag": etag}
+        for key, version_id, es_marcador, tamano, etag in filas
+        if not es_marcador
+    }
+
+
+def descargar_snapshot(s3_client, bucket_name, ruta_indice, prefijo, instante, directorio_destino,
+                       max_workers=8, transfer_config=None):
+    """Descarga en paralelo el prefijo tal y como estaba en el instante indicado."""
+    snapshot = estado_en(ruta_indice, bucket_name, prefijo, instante)
+    print(f"🔹 Descargando snapshot de {len(snapshot)} objetos a '{directorio_destino}'...")
+
+    def descargar(item):
+        key, version = item
+        destino = os.path.join(directorio_destino, *key[len(prefijo):].lstrip("/").split("/"))
+        os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+        descargar_con_cache(s3_client, bucket_name, key, destino, version_id=version["VersionId"],
+                            transfer_config=transfer_config)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(descargar, snapshot.items()))
+    print("✅ Snapshot descargado\n")
+    return snapshot
+
+
+# -----------------------------
+# ÍNDICE LOCAL DESDE S3 INVENTORY (consultas sin LIST)
+# -----------------------------
+# Columnas del informe de inventario (normalizadas: minúsculas y sin '_') -> columna del índice
+COLUMNAS_INVENTARIO = {
+    "key": "key",
+    "versionid": "version_id",
+    "islatest": "es_ultima",
+    "isdeletemarker": "es_marcador",
+    "size": "tamano",
+    "lastmodifieddate": "last_modified",
+    "etag": "etag",
+    "storageclass": "clase",
+}
+
+
+def _abrir_indice_inventario(ruta_indice):
+    conexion = sqlite3.connect(ruta_indice, timeout=30)
+    conexion.execute("""
+        CREATE TABLE IF NOT EXISTS inventario (
+            bucket TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version_id TEXT NOT NULL,
+            es_ultima INTEGER NOT NULL,
+            es_marcador INTEGER NOT NULL,
+            tamano INTEGER,
+            last_modified REAL,
+            etag TEXT,
+            clase TEXT,
+            restauracion TEXT,
+            informe REAL NOT NULL,
+            PRIMARY KEY (bucket, key, version_id)
+        ) WITHOUT ROWID
+    """)
+    conexion.execute("CREATE INDEX IF NOT EXISTS idx_inventario_clase ON inventario (bucket, clase, tamano)")
+    conexion.execute("CREATE INDEX IF NOT EXISTS idx_inventario_fecha ON inventario (bucket, last_modified)")
+    conexion.execute("""
+        CREATE TABLE IF NOT EXISTS informes (
+            bucket TEXT PRIMARY KEY,
+            manifiesto TEXT NOT NULL,
+            creado REAL NOT NULL
+        )
+    """)
+    return conexion
+
+
+def _ultimo_manifiesto(s3_client, bucket_destino, prefijo_inventario):
+    """Key del manifest.json más reciente (las carpetas del inventario llevan la fecha en el nombre)."""
+    manifiestos = [
+        obj["Key"] for obj in listar_paralelo(s3_client, bucket_destino, prefijo_inventario)
+        if obj["Key"].endswith("/manifest.json")
+    ]
+    if not manifiestos:
+        raise FileNotFoundError(f"No hay manifest.json en s3://{bucket_destino}/{prefijo_inventario}")
+    return max(manifiestos)
+
+
+def _valor_inventario(columna, valor):
+    if valor in (None, ""):
+        return None
+    if columna in ("es_ultima", "es_marcador"):
+        return int(valor in (True, "true", "TRUE", "True"))
+    if columna == "tamano":
+        return int(valor)
+    if columna == "last_modified":
+        return _a_epoch(valor)
+    if columna == "etag":
+        return valor if valor.startswith('"') else f'"{valor}"'  # mismo formato que LIST/HEAD
+    return valor
+
+
+def _filas_inventario(s3_client, bucket_destino, archivo, formato, esquema):
+    """Lee un archivo del informe (CSV gzip o Parquet) y genera dicts {columna: valor}."""
+    response = s3_client.get_object(Bucket=bucket_destino, Key=archivo["key"])
+    if formato == "CSV":
+        columnas = [COLUMNAS_INVENTARIO.get(c.strip().lower().replace("_", "")) for c in esquema.split(",")]
+        with gzip.GzipFile(fileobj=response["Body"]) as comprimido:
+            for fila in csv.reader(io.TextIOWrapper(comprimido, encoding="utf-8", newline="")):
+                registro = {c: _valor_inventario(c, v) for c, v in zip(columnas, fila) if c}
+                registro["key"] = unquote_plus(registro["key"])  # el CSV trae las keys codificadas como URL
+                yield registro
+    elif formato == "Parquet":
+        try:
+            import pyarrow.parquet as pq  # dependencia opcional: solo para informes Parquet
+        except ImportError:
+            raise ImportError("Los informes de inventario en Parquet necesitan 'pyarrow' (pip install pyarrow)")
+        with tempfile.TemporaryFile() as temporal:
+            for bloque in response["Body"].iter_chunks(MB):
+                temporal.write(bloque)
+            temporal.seek(0)
+            for lote in pq.ParquetFile(temporal).iter_batches(batch_size=10000):
+                columnas = [COLUMNAS_INVENTARIO.get(c.lower().replace("_", "")) for c in lote.schema.names]
+                for fila in zip(*(col.to_pylist() for col in lote.columns)):
+                    yield {c: _valor_inventario(c, v) for c, v in zip(columnas, fila) if c}
+    else:
+        raise ValueError(f"Formato de inventario no soportado: {formato}")
+
+
+def ingerir_inventario(s3_client, bucket_destino, prefijo_inventario, ruta_indice=None, max_workers=4):
+    """
+    Carga en un índice SQLite el informe de S3 Inventory más reciente que haya
+    bajo 'prefijo_inventario' (destino/bucket-origen/id-configuración/). Si ese
+    manifiesto ya se cargó no hace nada; si es nuevo actualiza las filas,
+    conserva el estado de restauración anotado y elimina lo que ya no aparece.
+    """
+    clave_manifiesto = _ultimo_manifiesto(s3_client, bucket_destino, prefijo_inventario)
+    manifiesto = json.loads(s3_client.get_object(Bucket=bucket_destino, Key=clave_manifiesto)["Body"].read())
+    bucket_origen = manifiesto["sourceBucket"]
+    creado = int(manifiesto["creationTimestamp"]) / 1000
+    ruta_indice = ruta_indice or f"inventario_{bucket_origen}.sqlite"
+
+    conexion = _abrir_indice_inventario(ruta_indice)
+    anterior = conexion.execute("SELECT creado FROM informes WHERE bucket = ?", (bucket_origen,)).fetchone()
+    if anterior and anterior[0] >= creado:
+        print(f"✅ El inventario de '{bucket_origen}' ya está al día ({clave_manifiesto})\n")
+        conexion.close()
+        return ruta_indice
+
+    print(f"🔹 Cargando inventario de '{bucket_origen}' ({len(manifiesto['files'])} archivos) en '{ruta_indice}'...")
+    lotes = queue.Queue(maxsize=max_workers * 2)
+    cancelado = threading.Event()
+
+    def emitir(lote):
+        # Si el consumidor ha fallado nadie vaciará la cola: no quedarse bloqueado en put()
+        while not cancelado.is_set():
+            try:
+                lotes.put(lote, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def leer(archivo):
+        try:
+            lote = []
+            for registro in _filas_inventario(s3_client, bucket_destino, archivo,
+                                              manifiesto["fileFormat"], manifiesto.get("fileSchema", "")):
+                if cancelado.is_set():
+                    return
+                lote.append((
+                    bucket_origen, registro["key"], registro.get("version_id") or "",
+                    registro.get("es_ultima", 1), registro.get("es_marcador", 0), registro.get("tamano"),
+                    registro.get("last_modified"), registro.get("etag"), registro.get("clase"), creado
+                ))
+                if len(lote) == 10000:
+                    emitir(lote)
+                    lote = []
+            emitir(lote)
+        finally:
+            emitir(None)
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(leer, archivo) for archivo in manifiesto["files"]]
+        try:
+            with conexion:
+                terminados = 0
+                while terminados < len(futures):
+                    lote = lotes.get()
+                    if lote is None:
+                        terminados += 1
+                        continue
+                    conexion.executemany("""
+                        INSERT INTO inventario (bucket, key, version_id, es_ultima, es_marcador, tamano,
+                                                last_modified, etag, clase, informe)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (bucket, key, version_id) DO UPDATE SET
+                            es_ultima = excluded.es_ultima, es_marcador = excluded.es_marcador,
+                            tamano = excluded.tamano, last_modified = excluded.last_modified,
+                            restauracion = CASE WHEN excluded.etag = inventario.etag
+                                                AND excluded.clase = inventario.clase
+                                                THEN inventario.restauracion END,
+                            etag = excluded.etag, clase = excluded.clase, informe = excluded.informe
+                    """, lote)
+                    total += len(lote)
+                for future in futures:
+                    future.result()  # propaga errores de lectura antes de confirmar
+                # Lo que no aparece en el informe nuevo ya no existe en el bucket
+                conexion.execute("DELETE FROM inventario WHERE bucket = ? AND informe < ?", (bucket_origen, creado))
+                conexion.execute("INSERT OR REPLACE INTO informes VALUES (?, ?, ?)", (bucket_origen, clave_manifiesto, creado))
+        finally:
+            cancelado.set()
+    conexion.close()
+    print(f"✅ {total} filas de inventario cargadas\n")
+    return ruta_indice
+
+
+def consultar_inventario(ruta_indice, bucket_name, prefijo="", clases=None, min_bytes=None, max_bytes=None,
+                         modificado_desde=None, modificado_hasta=None, restauracion=None, solo_ultimas=True):
+    """
+    Generador de objetos del índice de inventario que cumplen los filtros, con
+    las mismas claves que list_objects_v2 (Key, Size, StorageClass...).
+    restauracion: None (sin filtro), "ninguna" o el estado anotado
+    ("en_curso", "restaurada").
+    """
+    condiciones = ["bucket = ?", "substr(key, 1, ?) = ?", "es_marcador = 0"]
+    parametros = [bucket_name, len(prefijo), prefijo]
+    if solo_ultimas:
+        condiciones.append("es_ultima = 1")
+    if clases:
+        condiciones.append(f"clase IN ({', '.join('?' * len(clases))})")
+        parametros.extend(clases)
+    for condicion, valor in (("tamano >= ?", min_bytes), ("tamano <= ?", max_bytes)):
+        if valor is not None:
+            condiciones.append(condicion)
+            parametros.append(valor)
+    for condicion, instante in (("last_modified >= ?", modificado_desde), ("last_modified <= ?", modificado_hasta)):
+        if instante is not None:
+            condiciones.append(condicion)
+            parametros.append(_a_epoch(instante))
+    if restauracion == "ninguna":
+        condiciones.append("restauracion IS NULL")
+    elif restauracion is not None:
+        condiciones.append("restauracion = ?")
+        parametros.append(restauracion)
+
+    conexion = _abrir_indice_inventario(ruta_indice)
+    try:
+        filas = conexion.execute(f"""
+            SELECT key, version_id, tamano, clase, last_modified, etag, restauracion
+            FROM inventario WHERE {' AND '.join(condiciones)} ORDER BY key
+        """, parametros)
+        for key, version_id, tamano, clase, last_modified, etag, estado in filas:
+            yield {
+                "Key": key,
+                "VersionId": version_id or None,
+                "Size": tamano,
+                "StorageClass": clase or "STANDARD",
+                "LastModified": datetime.fromtimestamp(last_modified, timezone.utc) if last_modified else None,
+                "ETag": etag,
+                "Restauracion": estado,
+            }
+    finally:
+        conexion.close()
+
+
+def marcar_restauracion(ruta_indice, bucket_name, keys, estado):
+    """Anota en el índice el estado de restauración de las keys ("en_curso", "restaurada" o None)."""
+    conexion = _abrir_indice_inventario(ruta_indice)
+    with conexion:
+        conexion.executemany(
+            "UPDATE inventario SET restauracion = ? WHERE bucket = ? AND key = ? AND es_ultima = 1",
+            [(estado, bucket_name, key) for key in keys]
+        )
+    conexion.close()
+
+
+# -----------------------------
+# S3 SELECT (filtrado en el servidor)
+# -----------------------------
+def consultar_objeto(s3_client, bucket_name, key_s3, sql, formato="csv", compresion="NONE",
+                     estadisticas=None):
+    """
+    Ejecuta una consulta SQL de S3 Select sobre un CSV con cabecera o un NDJSON
+    y devuelve un iterador de filas (diccionarios) a medida que llegan los
+    eventos, sin descargar el objeto completo. En el SQL el objeto es S3Object,
+    p. ej. "SELECT s.nombre FROM S3Object s WHERE CAST(s.edad AS INT) > 30".
+    Si se pasa un diccionario en estadisticas, se rellena con los bytes escaneados/devueltos.
+    """
+    if formato == "csv":
+        entrada = {"CSV": {"FileHeaderInfo": "USE", "RecordDelimiter": "\n", "FieldDelimiter": ","}}
+    elif formato == "ndjson":
+        entrada = {"JSON": {"Type": "LINES"}}
+    else:
+        raise ValueError(f"Formato no soportado: {formato} (usa 'csv' o 'ndjson')")
+    entrada["CompressionType"] = compresion
+
+    response = s3_client.select_object_content(
         Bucket=bucket_name,
-        Prefix=key_s3
+        Key=key_s3,
+        Expression=sql,
+        ExpressionType="SQL",
+        InputSerialization=entrada,
+        OutputSerialization={"JSON": {"RecordDelimiter": "\n"}}
     )
 
-    versions = response.get("Versions", [])
+    pendiente = b""
+    for evento in response["Payload"]:
+        if "Records" in evento:
+            # Un registro puede quedar partido entre dos eventos: se guarda el resto para el siguiente
+            pendiente += evento["Records"]["Payload"]
+            *lineas, pendiente = pendiente.split(b"\n")
+            for linea in lineas:
+                if linea.strip():
+                    yield json.loads(linea)
+        elif "Stats" in evento and estadisticas is not None:
+            estadisticas.update(evento["Stats"]["Details"])
+    if pendiente.strip():
+        yield json.loads(pendiente)
 
-    for v in versions:
-        print(f"VersionId: {v['VersionId']} | Última: {v['IsLatest']}")
 
-    print("✅ Versiones listadas\n")
+# -----------------------------
+# CACHÉ DE METADATOS (head_object / head_bucket)
+# -----------------------------
+class ClienteS3ConCache:
+    """
+    Envuelve un client S3 y cachea las respuestas de head_object/head_bucket
+    (también los 404) con TTL y expulsión LRU. Al caducar, los objetos se
+    revalidan con If-None-Match sobre su ETag; las escrituras hechas a través
+    del envoltorio invalidan las entradas afectadas. El resto de operaciones
+    se delegan tal cual en el client original.
+    """
+
+    # Operación de escritura -> posición de (Bucket, Key) si se pasan como argumentos posicionales
+    ESCRITURAS = {
+        "put_object": None, "copy_object": None, "delete_object": None, "restore_object": None,
+        "complete_multipart_upload": None, "put_object_tagging": None, "delete_object_tagging": None,
+        "put_object_acl": None, "delete_objects": None, "create_bucket": None, "delete_bucket": None,
+        "upload_file": (1, 2), "upload_fileobj": (1, 2), "copy": (1, 2),
+    }
+
+    def __init__(self, s3_client, ttl=30, max_entradas=1024):
+        self._client = s3_client
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self.ESCRITURAS:
+            return attr
+
+        def escritura(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._invalidar_escritura(name, args, kwargs)
+
+        return escritura
+
+    # ---- caché ----
+    def _obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+            return entrada
+
+    def _guardar(self, clave, resultado, es_error=False):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, resultado, es_error)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def _consultar(self, clave, llamada, revalidable=False):
+        entrada = self._obtener(clave)
+        if entrada is not None:
+            expira, resultado, es_error = entrada
+            if time.monotonic() < expira:
+                self.aciertos += 1
+                if es_error:
+                    raise resultado
+                return resultado
+            # Caducada: si el objeto no puede haber cambiado de estado sin cambiar de ETag, basta un 304
+            if revalidable and not es_error and "Restore" not in resultado \
+                    and resultado.get("StorageClass") not in TIERS_RESTAURACION:
+                try:
+                    resultado = llamada(IfNoneMatch=resultado["ETag"])
+                except self._client.exceptions.ClientError as e:
+                    if e.response["Error"]["Code"] not in ("304", "NotModified"):
+                        raise
+                self._guardar(clave, resultado)
+                self.fallos += 1
+                return resultado
+
+        self.fallos += 1
+        try:
+            resultado = llamada()
+        except self._client.exceptions.ClientError as e:
+            # Cachea también "no existe" para que las comprobaciones repetidas no vuelvan a S3
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NoSuchBucket", "NotFound"):
+                self._guardar(clave, e, es_error=True)
+            raise
+        self._guardar(clave, resultado)
+        return resultado
+
+    def head_object(self, **kwargs):
+        if set(kwargs) - {"Bucket", "Key", "VersionId"}:
+            return self._client.head_object(**kwargs)
+        clave = ("object", kwargs["Bucket"], kwargs["Key"], kwargs.get("VersionId"))
+        llamada = functools.partial(self._client.head_object, **kwargs)
+        return self._consultar(clave, llamada, revalidable="VersionId" not in kwargs)
+
+    def head_bucket(self, **kwargs):
+        if set(kwargs) != {"Bucket"}:
+            return self._client.head_bucket(**kwargs)
+        return self._consultar(("bucket", kwargs["Bucket"]), functools.partial(self._client.head_bucket, **kwargs))
+
+    # ---- invalidación ----
+    def invalidar(self, bucket_name, key=None):
+        """Elimina de la caché un objeto (todas sus versiones) o, sin key, todo lo del bucket."""
+        with self._lock:
+            for clave in list(self._entradas):
+                if clave[1] == bucket_name and (key is None or clave[0] == "object" and clave[2] == key):
+                    del self._entradas[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def _invalidar_escritura(self, operacion, args, kwargs):
+        posiciones = self.ESCRITURAS[operacion]
+        bucket_name = kwargs.get("Bucket")
+        key = kwargs.get("Key")
+        if posiciones is not None:
+            bucket_name = bucket_name or (args[posiciones[0]] if len(args) > posiciones[0] else None)
+            key = key or (args[posiciones[1]] if len(args) > posiciones[1] else None)
+        if bucket_name is None:
+            return
+        if operacion in ("create_bucket", "delete_bucket"):
+            self.invalidar(bucket_name)
+        elif operacion == "delete_objects":
+            for obj in kwargs.get("Delete", {}).get("Objects", []):
+                self.invalidar(bucket_name, obj["Key"])
+        elif key is not None:
+            self.invalidar(bucket_name, key)
+
+
+def bucket_existe(s3_client, bucket_name):
+    """Comprueba si el bucket existe (con ClienteS3ConCache la respuesta queda cacheada)."""
+    try:
+        s3_client.head_bucket(Bucket=bucket_name)
+        return True
+    except s3_client.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchBucket", "NotFound"):
+            return False
+        raise
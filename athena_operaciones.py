@@ -0,0 +1,680 @@
+import os
+import codecs
+import csv
+import hashlib
+import json
+import multiprocessing
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from aws_session import get_s3_client, lazy_client
+from S3_operaciones import eliminar_prefijo, leer_objeto_rangos, listar_paralelo, obtener_cache_local
+
+# Estados en los que una ejecución de Athena ya no cambia
+ESTADOS_FINALES = ("SUCCEEDED", "FAILED", "CANCELLED")
+# Máximo de ids por llamada a batch_get_query_execution
+MAX_IDS_BATCH = 50
+
+
+class ErrorConsultaAthena(Exception):
+    """La query terminó en FAILED o CANCELLED."""
+
+    def __init__(self, ejecucion):
+        self.ejecucion = ejecucion
+        self.query_execution_id = ejecucion["QueryExecutionId"]
+        self.estado = ejecucion["Status"]["State"]
+        self.motivo = ejecucion["Status"].get("StateChangeReason", "")
+        super().__init__(f"{self.estado} - {self.motivo}")
+
+
+# -----------------------------
+# LECTURA DE RESULTADOS (todas las filas, en streaming)
+# -----------------------------
+def _separar_ruta_s3(ruta):
+    bucket_name, _, key = ruta[len("s3://"):].partition("/")
+    return bucket_name, key
+
+
+def _metadatos_tabla(athena, database, tabla):
+    """(database, tabla, TableMetadata) de una tabla, admitiendo 'db.tabla' y nombres entre comillas."""
+    tabla = tabla.replace('"', "")
+    if "." in tabla:
+        database, tabla = tabla.split(".", 1)
+    metadatos = athena.get_table_metadata(
+        CatalogName="AwsDataCatalog", DatabaseName=database, TableName=tabla
+    )["TableMetadata"]
+    return database, tabla, metadatos
+
+
+def _lineas(bloques):
+    """Convierte bloques de bytes UTF-8 en líneas (con su salto) para csv.reader."""
+    decodificador = codecs.getincrementaldecoder("utf-8")()
+    resto = ""
+    for bloque in bloques:
+        lineas = (resto + decodificador.decode(bloque)).split("\n")
+        resto = lineas.pop()
+        for linea in lineas:
+            yield linea + "\n"
+    resto += decodificador.decode(b"", final=True)
+    if resto:
+        yield resto
+
+
+def _filas_api(athena_client, query_execution_id, tamano_pagina=1000):
+    paginator = athena_client.get_paginator("get_query_results")
+    paginas = paginator.paginate(QueryExecutionId=query_execution_id, PaginationConfig={"PageSize": tamano_pagina})
+    for pagina in paginas:
+        for row in pagina["ResultSet"]["Rows"]:
+            yield [col.get("VarCharValue", "") for col in row["Data"]]
+
+
+def leer_resultados(athena_client, ejecucion, s3_client=None, origen="auto", max_workers=4):
+    """
+    Generador de todas las filas (listas de strings, cabecera incluida) de una
+    query terminada. Con origen="s3" lee el CSV que Athena deja en
+    OutputLocation por rangos en paralelo y lo parsea a medida que llega; con
+    origen="api" recorre todas las páginas de get_query_results. En "auto" se
+    usa el CSV para las SELECT (DML) y la API para DDL/UTILITY.
+    """
+    ruta = ejecucion.get("ResultConfiguration", {}).get("OutputLocation", "")
+    if origen == "auto":
+        origen = "s3" if ejecucion.get("StatementType") == "DML" and ruta.endswith(".csv") else "api"
+    if origen == "api":
+        yield from _filas_api(athena_client, ejecucion["QueryExecutionId"])
+        return
+
+    s3_client = s3_client or lazy_client("s3")
+    bucket_name, key = _separar_ruta_s3(ruta)
+    yield from csv.reader(_lineas(leer_objeto_rangos(s3_client, bucket_name, key, max_workers=max_workers)))
+
+
+# -----------------------------
+# EJECUTOR CONCURRENTE DE QUERIES
+# -----------------------------
+class EjecutorAthena:
+    """
+    Lanza queries de Athena sin esperar a que terminen y devuelve un Future por
+    query. Un único hilo en segundo plano arranca las queries en cola (como
+    mucho 'max_en_vuelo' a la vez) y consulta el estado de todas las activas con
+    batch_get_query_execution, 50 ids por llamada. El intervalo entre consultas
+    crece (x factor) mientras no termina ninguna y vuelve al mínimo cuando
+    alguna acaba. El Future se resuelve con el QueryExecution (SUCCEEDED) o con
+    ErrorConsultaAthena.
+    """
+
+    def __init__(self, athena_client=None, database=None, output_location=None, workgroup=None,
+                 max_en_vuelo=20, intervalo_min=0.25, intervalo_max=5, factor=1.5, s3_client=None):
+        self.athena = athena_client or lazy_client("athena")
+        self.s3 = s3_client or lazy_client("s3")
+        self.database = database
+        self.output_location = output_location
+        self.workgroup = workgroup
+        self.max_en_vuelo = max_en_vuelo
+        self.intervalo_min = intervalo_min
+        self.intervalo_max = intervalo_max
+        self.factor = factor
+        self._cond = threading.Condition()
+        self._cola = deque()
+        self._en_vuelo = {}
+        self._hilo = None
+
+    def enviar(self, query, database=None, output_location=None, reutilizar_minutos=None):
+        """
+        Pone la query en cola y devuelve su Future inmediatamente. Con
+        reutilizar_minutos, Athena devuelve el resultado de una ejecución
+        idéntica más reciente que ese tiempo en lugar de volver a escanear.
+        """
+        kwargs = {"QueryString": query}
+        database = database or self.database
+        if database:
+            kwargs["QueryExecutionContext"] = {"Database": database}
+        output_location = output_location or self.output_location
+        if output_location:
+            kwargs["ResultConfiguration"] = {"OutputLocation": output_location}
+        if self.workgroup:
+            kwargs["WorkGroup"] = self.workgroup
+        if reutilizar_minutos:
+            kwargs["ResultReuseConfiguration"] = {
+                "ResultReuseByAgeConfiguration": {"Enabled": True, "MaxAgeInMinutes": reutilizar_minutos}
+            }
+
+        future = Future()
+        with self._cond:
+            self._cola.append((kwargs, future))
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name="athena-poller", daemon=True)
+                self._hilo.start()
+            self._cond.notify()
+        return future
+
+    def enviar_varias(self, queries, database=None, output_location=None):
+        """Lanza todas las queries a la vez; devuelve sus Futures en el mismo orden."""
+        return [self.enviar(query, database=database, output_location=output_location) for query in queries]
+
+    def enviar_async(self, query, database=None, output_location=None):
+        """Versión awaitable de enviar() para usar desde asyncio."""
+        import asyncio  # solo lo necesita quien use el ejecutor desde código asíncrono
+        return asyncio.wrap_future(self.enviar(query, database=database, output_location=output_location))
+
+    def ejecutar(self, query, database=None, output_location=None, timeout=None, reutilizar_minutos=None):
+        """Lanza la query y espera su QueryExecution (o ErrorConsultaAthena)."""
+        future = self.enviar(query, database=database, output_location=output_location,
+                             reutilizar_minutos=reutilizar_minutos)
+        return future.result(timeout)
+
+    def resultados(self, future, origen="auto"):
+        """Iterador con todas las filas de la query del Future (ver leer_resultados), o None si ha fallado."""
+        try:
+            ejecucion = future.result()
+        except ErrorConsultaAthena as e:
+            print(f"❌ Error en query: {e.estado} - {e.motivo}")
+            return None
+        return leer_resultados(self.athena, ejecucion, s3_client=self.s3, origen=origen)
+
+    # ---- hilo de seguimiento ----
+    def _lanzar(self, por_lanzar):
+        for kwargs, future in por_lanzar:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                qid = self.athena.start_query_execution(**kwargs)["QueryExecutionId"]
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            with self._cond:
+                self._en_vuelo[qid] = future
+
+    def _consultar(self):
+        """Actualiza el estado de todas las queries activas; devuelve cuántas han terminado."""
+        with self._cond:
+            ids = list(self._en_vuelo)
+        terminadas = 0
+        for i in range(0, len(ids), MAX_IDS_BATCH):
+            response = self.athena.batch_get_query_execution(QueryExecutionIds=ids[i:i + MAX_IDS_BATCH])
+            # Los ids en UnprocessedQueryExecutionIds se vuelven a pedir en la siguiente vuelta
+            for ejecucion in response.get("QueryExecutions", []):
+                if ejecucion["Status"]["State"] not in ESTADOS_FINALES:
+                    continue
+                with self._cond:
+                    future = self._en_vuelo.pop(ejecucion["QueryExecutionId"])
+                if ejecucion["Status"]["State"] == "SUCCEEDED":
+                    future.set_result(ejecucion)
+                else:
+                    future.set_exception(ErrorConsultaAthena(ejecucion))
+                terminadas += 1
+        return terminadas
+
+    def _bucle(self):
+        intervalo = self.intervalo_min
+        try:
+            while True:
+                with self._cond:
+                    if not self._cola and not self._en_vuelo:
+                        self._hilo = None
+                        return
+                    huecos = max(0, self.max_en_vuelo - len(self._en_vuelo))
+                    por_lanzar = [self._cola.popleft() for _ in range(min(huecos, len(self._cola)))]
+                self._lanzar(por_lanzar)
+
+                terminadas = self._consultar()
+                intervalo = self.intervalo_min if terminadas else min(self.intervalo_max, intervalo * self.factor)
+
+                with self._cond:
+                    if self._cola and len(self._en_vuelo) < self.max_en_vuelo:
+                        continue  # hay huecos libres: arrancar ya lo que espera
+                    self._cond.wait(intervalo)  # enviar() despierta al hilo antes de tiempo
+        except Exception as e:
+            # Error no recuperable (los reintentos ya los hace botocore): se propaga a todas las queries
+            with self._cond:
+                pendientes = list(self._en_vuelo.values()) + [future for _, future in self._cola]
+                self._en_vuelo.clear()
+                self._cola.clear()
+                self._hilo = None
+            for future in pendientes:
+                if not future.done():
+                    future.set_exception(e)
+
+
+# -----------------------------
+# CACHÉ DE RESULTADOS (SQL normalizada + huella de los datos de origen)
+# -----------------------------
+_LITERALES = re.compile(r"('(?:[^']|'')*')")
+_TOKENS_SQL = re.compile(r'(?:"[^"]*"|\w+)(?:\.(?:"[^"]*"|\w+))*|\S')
+_IDENTIFICADOR = re.compile(r'(?:"[^"]*"|\w+)(?:\.(?:"[^"]*"|\w+))*$')
+_CTES = re.compile(r'(?:^with(?:\s+recursive)?|,)\s*"?(\w+)"?\s*(?:\([^)]*\)\s*)?as\s*\(')
+# Funciones cuyo 'from' es sintaxis del argumento y no una tabla: extract(year from ts)
+_FUNCIONES_CON_FROM = {"extract", "substring", "trim", "overlay"}
+# Palabras que cierran la lista de relaciones de un FROM/JOIN
+_FIN_RELACIONES = {
+    "where", "group", "order", "limit", "having", "join", "left", "right", "inner", "full", "cross",
+    "natural", "on", "using", "union", "intersect", "except", "window", "offset", "fetch"
+}
+_SUBCONSULTA = "<relación>"
+
+
+def _tablas_consultadas(sql):
+    """
+    Tablas que lee una query normalizada, o None si no se reconocen todas sus
+    relaciones (entonces no se puede cachear con seguridad). Por ejemplo:
+      select * from a, db.b t2 where a.id = t2.id            -> {a, db.b}
+      with c as (select * from t1) select * from c join t3    -> {t1, t3} (c es una CTE)
+      select extract(year from ts) from t4                   -> {t4}
+      select * from t5 tablesample bernoulli (10)            -> None
+    """
+    sql = "".join(parte if i % 2 == 0 else "''" for i, parte in enumerate(_LITERALES.split(sql)))
+    ctes = set(_CTES.findall(sql)) if sql.startswith("with") else set()
+    tokens = _TOKENS_SQL.findall(sql)
+    tablas, funciones = set(), []
+
+    def relacion(i):
+        """Lee una relación de la lista del FROM; devuelve la posición siguiente o None."""
+        if i >= len(tokens):
+            return None
+        if tokens[i] == "(":
+            funciones.append(_SUBCONSULTA)  # la subconsulta la recorre el bucle principal
+            return i + 1
+        if not _IDENTIFICADOR.match(tokens[i]) or tokens[i] in _FIN_RELACIONES or tokens[i] == "lateral":
+            return None
+        if i + 1 < len(tokens) and tokens[i + 1] == "(":
+            if tokens[i] != "unnest":
+                return None
+            funciones.append(_SUBCONSULTA)
+            return i + 2
+        if tokens[i].replace('"', "") not in ctes:
+            tablas.add(tokens[i])
+        return tras_relacion(i + 1)
+
+    def tras_relacion(i):
+        """Salta el alias (y sus columnas); si sigue una coma, lee la siguiente relación."""
+        if i < len(tokens) and tokens[i] == "as":
+            i += 1
+        if i < len(tokens) and _IDENTIFICADOR.match(tokens[i]) and tokens[i] not in _FIN_RELACIONES:
+            i += 1
+            if i < len(tokens) and tokens[i] == "(":
+                while i < len(tokens) and tokens[i] != ")":
+                    i += 1
+                i += 1
+        if i >= len(tokens) or tokens[i] == ")" or tokens[i] in _FIN_RELACIONES:
+            return i
+        if tokens[i] == ",":
+            return relacion(i + 1)
+        return None
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("from", "join") and not (funciones and funciones[-1] in _FUNCIONES_CON_FROM):
+            i = relacion(i + 1)
+            if i is None:
+                return None
+            continue
+        if token == "(":
+            funciones.append(tokens[i - 1] if i else "")
+        elif token == ")" and funciones and funciones.pop() == _SUBCONSULTA:
+            i = tras_relacion(i + 1)
+            if i is None:
+                return None
+            continue
+        i += 1
+    return tablas
+
+
+def normalizar_sql(query):
+    """Minúsculas, espacios colapsados y sin ';' final, respetando los literales entre comillas."""
+    partes = _LITERALES.split(query.strip().rstrip(";").strip())
+    return "".join(
+        parte if i % 2 else re.sub(r"\s+", " ", parte.lower())
+        for i, parte in enumerate(partes)
+    ).strip()
+
+
+class CacheResultadosAthena:
+    """
+    Delante de un EjecutorAthena: una SELECT ya ejecutada sobre datos que no
+    han cambiado se responde sin volver a Athena. La clave es la SQL
+    normalizada más una huella de los ETags de todos los objetos bajo el
+    LOCATION de cada tabla consultada y de su definición (columnas y claves de
+    partición). El índice (clave -> ejecución) vive en
+    SQLite y las filas se leen del CSV de resultados a través de la caché local
+    de objetos (presupuesto de bytes y LRU de S3_CACHE_MAX_BYTES), así que
+    siguen disponibles aunque se borren de S3. Si la huella coincide con la de
+    la última ejecución pero no hay resultado guardado, se pide a Athena que
+    reutilice el suyo (ResultReuseConfiguration, 'reutilizar_minutos').
+    """
+
+    def __init__(self, ejecutor, ruta_indice=None, cache_objetos=None, reutilizar_minutos=60, max_workers=8):
+        self.ejecutor = ejecutor
+        self.cache_objetos = cache_objetos
+        self.ruta_indice = ruta_indice
+        self.reutilizar_minutos = reutilizar_minutos
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._iniciada = False
+        self.aciertos = 0
+
+    def _iniciar(self):
+        """Abre la caché de objetos y el índice en el primer uso (importar el script no crea nada en disco)."""
+        with self._lock:
+            if self._iniciada:
+                return
+            self.cache_objetos = self.cache_objetos or obtener_cache_local()
+            self.ruta_indice = self.ruta_indice or os.path.join(
+                self.cache_objetos.directorio if self.cache_objetos else ".", "athena_resultados.sqlite"
+            )
+            with self._conectar() as conexion:
+                conexion.execute("""
+                    CREATE TABLE IF NOT EXISTS consultas (
+                        clave TEXT PRIMARY KEY,
+                        database TEXT NOT NULL,
+                        sql TEXT NOT NULL,
+                        huella TEXT NOT NULL,
+                        ejecucion TEXT NOT NULL,
+                        creado REAL NOT NULL
+                    )
+                """)
+                conexion.execute("CREATE INDEX IF NOT EXISTS idx_consultas_sql ON consultas (database, sql, creado)")
+            self._iniciada = True
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta_indice, timeout=30)
+
+    # ---- huella de los datos ----
+    def _definicion(self, database, tabla):
+        """(LOCATION, columnas y claves de partición) de la tabla; se consulta en cada huella por si hubo un ALTER."""
+        database, tabla, metadatos = _metadatos_tabla(self.ejecutor.athena, database, tabla)
+        columnas = [
+            [(c["Name"], c["Type"]) for c in metadatos.get(campo, [])]
+            for campo in ("Columns", "PartitionKeys")
+        ]
+        return metadatos["Parameters"]["location"], json.dumps([database, tabla, columnas])
+
+    def huella(self, sql, database):
+        """Hash de la definición de las tablas que lee la query y de (key, ETag) de todos sus objetos."""
+        resumen = hashlib.sha256()
+        resultados = self.ejecutor.output_location
+        tablas = _tablas_consultadas(sql)
+        if tablas is None:
+            raise ValueError("no se reconocen todas las tablas de la query")
+        definiciones = sorted(self._definicion(database, t) for t in tablas)
+        for definicion in definiciones:
+            resumen.update(definicion[1].encode())
+        for ubicacion in sorted({ubicacion for ubicacion, _ in definiciones}):
+            bucket_name, _, prefijo = ubicacion[len("s3://"):].partition("/")
+            # Los resultados de Athena pueden caer bajo el LOCATION: no cuentan como datos de origen
+            objetos = sorted(
+                (obj["Key"], obj["ETag"]) for obj in listar_paralelo(self.ejecutor.s3, bucket_name, prefijo)
+                if not (resultados and f"s3://{bucket_name}/{obj['Key']}".startswith(resultados))
+            )
+            resumen.update(json.dumps([ubicacion, objetos]).encode())
+        return resumen.hexdigest()
+
+    # ---- consulta ----
+    def _disponible(self, ejecucion):
+        ruta = ejecucion["ResultConfiguration"]["OutputLocation"]
+        bucket_name, key = _separar_ruta_s3(ruta)
+        if self.cache_objetos and self.cache_objetos.contiene(bucket_name, key):
+            return True
+        try:
+            self.ejecutor.s3.head_object(Bucket=bucket_name, Key=key)
+            return True
+        except self.ejecutor.s3.exceptions.ClientError:
+            return False
+
+    def _ejecutar(self, query, database):
+        database = database or self.ejecutor.database
+        sql = normalizar_sql(query)
+        if not sql.startswith(("select", "with")) or _tablas_consultadas(sql) == set():
+            return self.ejecutor.ejecutar(query, database=database)
+        self._iniciar()
+        try:
+            huella = self.huella(sql, database)
+        except Exception as e:
+            print(f"⚠ No se puede calcular la huella de los datos, se ejecuta sin caché: {e}")
+            return self.ejecutor.ejecutar(query, database=database)
+        clave = hashlib.sha256(f"{database}\n{sql}\n{huella}".encode()).hexdigest()
+
+        with self._conectar() as conexion:
+            fila = conexion.execute("SELECT ejecucion FROM consultas WHERE clave = ?", (clave,)).fetchone()
+            ultima = conexion.execute(
+                "SELECT huella FROM consultas WHERE database = ? AND sql = ? ORDER BY creado DESC LIMIT 1",
+                (database, sql)
+            ).fetchone()
+        if fila is not None:
+            ejecucion = json.loads(fila[0])
+            if self._disponible(ejecucion):
+                self.aciertos += 1
+                return ejecucion
+
+        # Athena solo puede reutilizar su resultado si los datos no han cambiado desde la última ejecución
+        reutilizar = self.reutilizar_minutos if ultima is not None and ultima[0] == huella else None
+        ejecucion = self.ejecutor.ejecutar(query, database=database, reutilizar_minutos=reutilizar)
+        with self._conectar() as conexion:
+            conexion.execute(
+                "INSERT OR REPLACE INTO consultas VALUES (?, ?, ?, ?, ?, ?)",
+                (clave, database, sql, huella, json.dumps(ejecucion, default=str), time.time())
+            )
+        return ejecucion
+
+    def enviar(self, query, database=None):
+        """Como EjecutorAthena.enviar(), consultando antes la caché."""
+        return self._pool.submit(self._ejecutar, query, database)
+
+    def enviar_varias(self, queries, database=None):
+        return [self.enviar(query, database=database) for query in queries]
+
+    def resultados(self, future):
+        """Iterador con todas las filas (pasando por la caché local de objetos), o None si ha fallado."""
+        try:
+            ejecucion = future.result()
+        except ErrorConsultaAthena as e:
+            print(f"❌ Error en query: {e.estado} - {e.motivo}")
+            return None
+        self._iniciar()
+        ruta = ejecucion.get("ResultConfiguration", {}).get("OutputLocation", "")
+        if self.cache_objetos is None or ejecucion.get("StatementType") != "DML" or not ruta.endswith(".csv"):
+            return leer_resultados(self.ejecutor.athena, ejecucion, s3_client=self.ejecutor.s3)
+        return self._filas_locales(*_separar_ruta_s3(ruta))
+
+    def _filas_locales(self, bucket_name, key):
+        descriptor, temporal = tempfile.mkstemp(suffix=".csv")
+        os.close(descriptor)
+        try:
+            self.cache_objetos.descargar(self.ejecutor.s3, bucket_name, key, temporal, inmutable=True)
+            with open(temporal, newline="", encoding="utf-8") as f:
+                yield from csv.reader(f)
+        finally:
+            os.remove(temporal)
+
+
+# -----------------------------
+# CONVERSIÓN A PARQUET (CTAS o local con pyarrow)
+# -----------------------------
+# Tipo de columna de Athena -> alias de tipo de pyarrow
+TIPOS_ARROW = {
+    "TINYINT": "int8",
+    "SMALLINT": "int16",
+    "INT": "int32",
+    "INTEGER": "int32",
+    "BIGINT": "int64",
+    "FLOAT": "float32",
+    "DOUBLE": "float64",
+    "BOOLEAN": "bool",
+    "STRING": "string",
+    "DATE": "date32",
+    "TIMESTAMP": "timestamp[ms]",
+}
+
+
+def convertir_tabla_ctas(ejecutor, tabla_origen, tabla_destino, ubicacion_destino, database=None,
+                         compresion="SNAPPY", particiones=None):
+    """
+    Crea 'tabla_destino' en Parquet comprimido con CREATE TABLE AS SELECT sobre
+    la tabla de texto. La ubicación se vacía antes porque CTAS exige que esté
+    vacía; las columnas de 'particiones' deben ser las últimas del SELECT *.
+    Lanza ValueError si la ubicación es la raíz de un bucket o se solapa con el
+    LOCATION de la tabla de origen (se borrarían sus datos).
+    """
+    bucket_name, prefijo = _separar_ruta_s3(ubicacion_destino)
+    if not prefijo.strip("/"):
+        raise ValueError(f"'{ubicacion_destino}' es la raíz del bucket: no se vacía un bucket entero")
+    _, _, metadatos = _metadatos_tabla(ejecutor.athena, database or ejecutor.database, tabla_origen)
+    bucket_origen, prefijo_origen = _separar_ruta_s3(metadatos["Parameters"]["location"])
+    # eliminar_prefijo borra toda key que empiece por 'prefijo': basta con que uno sea prefijo del otro
+    if bucket_origen == bucket_name and (prefijo.startswith(prefijo_origen) or prefijo_origen.startswith(prefijo)):
+        raise ValueError(
+            f"'{ubicacion_destino}' se solapa con la ubicación de '{tabla_origen}' "
+            f"(s3://{bucket_origen}/{prefijo_origen}): no se borra nada"
+        )
+    eliminar_prefijo(ejecutor.s3, bucket_name, prefijo)
+    ejecutor.ejecutar(f"DROP TABLE IF EXISTS {tabla_destino};", database=database)
+
+    propiedades = [
+        "format = 'PARQUET'",
+        f"write_compression = '{compresion}'",
+        f"external_location = '{ubicacion_destino}'",
+    ]
+    if particiones:
+        propiedades.append(f"partitioned_by = ARRAY[{', '.join(repr(p) for p in particiones)}]")
+    ejecucion = ejecutor.ejecutar(
+        f"CREATE TABLE {tabla_destino} WITH ({', '.join(propiedades)}) AS SELECT * FROM {tabla_origen};",
+        database=database
+    )
+    print(f"✅ Tabla Parquet '{tabla_destino}' creada en {ubicacion_destino}")
+    return ejecucion
+
+
+def _convertir_objeto(bucket_name, key_origen, key_destino, columnas, formato, cabecera, compresion):
+    """Trabajo de un proceso: descarga un CSV/NDJSON, lo escribe como Parquet y lo sube."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([(nombre, pa.type_for_alias(TIPOS_ARROW[tipo.upper()])) for nombre, tipo in columnas])
+    s3_client = get_s3_client()  # el proceso arranca con spawn: registry vacío, client propio
+    with tempfile.TemporaryDirectory() as directorio:
+        origen = os.path.join(directorio, "origen")
+        destino = os.path.join(directorio, "destino.parquet")
+        s3_client.download_file(Bucket=bucket_name, Key=key_origen, Filename=origen)
+        if formato == "csv":
+            import pyarrow.csv as pcsv
+            tabla = pcsv.read_csv(
+                origen,
+                read_options=pcsv.ReadOptions(column_names=esquema.names, skip_rows=1 if cabecera else 0),
+                convert_options=pcsv.ConvertOptions(column_types=esquema)
+            )
+        else:
+            import pyarrow.json as pjson
+            tabla = pjson.read_json(origen, parse_options=pjson.ParseOptions(explicit_schema=esquema))
+            tabla = tabla.select(esquema.names)
+        pq.write_table(tabla, destino, compression=compresion)
+        s3_client.upload_file(Filename=destino, Bucket=bucket_name, Key=key_destino)
+        return os.path.getsize(origen), os.path.getsize(destino)
+
+
+def convertir_objetos_a_parquet(s3_client, bucket_name, prefijo_origen, prefijo_destino, columnas, formato="csv",
+                                cabecera=True, compresion="snappy", max_workers=None):
+    """
+    Convierte cada CSV/NDJSON del prefijo en un Parquet comprimido bajo
+    'prefijo_destino', en paralelo en varios procesos (necesita pyarrow).
+    columnas: [(nombre, tipo Athena)], el mismo esquema que se registrará.
+    Devuelve los bytes totales antes y después.
+    """
+    objetos = [obj["Key"] for obj in listar_paralelo(s3_client, bucket_name, prefijo_origen) if obj["Size"]]
+    print(f"🔹 Convirtiendo {len(objetos)} objetos de '{prefijo_origen}' a Parquet ({compresion})...")
+    # spawn y no fork: un hijo forkeado heredaría los clients del registry del padre,
+    # con sus sockets y locks a medias, y podría bloquearse
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=contexto) as executor:
+        futures = [
+            executor.submit(
+                _convertir_objeto, bucket_name, key,
+                prefijo_destino + os.path.splitext(key[len(prefijo_origen):].lstrip("/"))[0] + ".parquet",
+                columnas, formato, cabecera, compresion
+            )
+            for key in objetos
+        ]
+        tamanos = [future.result() for future in futures]
+    total = {"bytes_origen": sum(t[0] for t in tamanos), "bytes_parquet": sum(t[1] for t in tamanos)}
+    print(f"✅ {total['bytes_origen']} B de texto -> {total['bytes_parquet']} B en Parquet")
+    return total
+
+
+def registrar_tabla_parquet(ejecutor, tabla, ubicacion, columnas, database=None, compresion="SNAPPY"):
+    """Registra una tabla externa Parquet (p. ej. la salida de convertir_objetos_a_parquet)."""
+    definicion = ",\n        ".join(f"{nombre} {tipo}" for nombre, tipo in columnas)
+    ejecutor.ejecutar(f"""
+    CREATE EXTERNAL TABLE IF NOT EXISTS {tabla} (
+        {definicion}
+    )
+    STORED AS PARQUET
+    LOCATION '{ubicacion}'
+    TBLPROPERTIES ('parquet.compression'='{compresion}');
+    """, database=database)
+    print(f"✅ Tabla Parquet '{tabla}' registrada en {ubicacion}")
+
+
+def comparar_escaneo(ejecutor, query_texto, query_parquet, database=None):
+    """Lanza la misma consulta sobre la tabla de texto y la Parquet e informa de los bytes escaneados y el tiempo."""
+    texto, parquet = (f.result() for f in ejecutor.enviar_varias([query_texto, query_parquet], database=database))
+    bytes_texto = texto["Statistics"]["DataScannedInBytes"]
+    bytes_parquet = parquet["Statistics"]["DataScannedInBytes"]
+    ahorro = 1 - bytes_parquet / bytes_texto if bytes_texto else 0
+    print(
+        f"📊 Escaneado: {bytes_texto} B (texto) -> {bytes_parquet} B (Parquet), ahorro {ahorro:.0%}; "
+        f"tiempo {texto['Statistics']['EngineExecutionTimeInMillis']} ms -> "
+        f"{parquet['Statistics']['EngineExecutionTimeInMillis']} ms"
+    )
+    return {"bytes_texto": bytes_texto, "bytes_parquet": bytes_parquet, "ahorro": ahorro}
+
+
+# -----------------------------
+# PARTICIONES (registro incremental o proyección)
+# -----------------------------
+def _literal_particion(valor):
+    return str(valor) if isinstance(valor, int) else "'" + str(valor).replace("'", "''") + "'"
+
+
+def registrar_particiones(ejecutor, tabla, ubicacion_base, particiones, database=None, por_sentencia=100):
+    """
+    Registra solo las particiones indicadas ([{"anio": 2024}, ...]) con
+    ALTER TABLE ADD IF NOT EXISTS PARTITION, agrupando 'por_sentencia'
+    particiones en cada sentencia, en lugar de que MSCK REPAIR TABLE recorra
+    todo el prefijo. Las sentencias se lanzan a la vez; devuelve cuántas
+    particiones se han enviado.
+    """
+    unicas = list({tuple(p.items()): p for p in particiones}.values())
+    if not unicas:
+        return 0
+    base = ubicacion_base.rstrip("/")
+    clausulas = [
+        "PARTITION ({}) LOCATION {}".format(
+            ", ".join(f"{col} = {_literal_particion(valor)}" for col, valor in p.items()),
+            _literal_particion(base + "/" + "/".join(f"{col}={valor}" for col, valor in p.items()) + "/")
+        )
+        for p in unicas
+    ]
+    sentencias = [
+        f"ALTER TABLE {tabla} ADD IF NOT EXISTS\n" + "\n".join(clausulas[i:i + por_sentencia]) + ";"
+        for i in range(0, len(clausulas), por_sentencia)
+    ]
+    for future in ejecutor.enviar_varias(sentencias, database=database):
+        future.result()
+    return len(unicas)
+
+
+def propiedades_proyeccion(ubicacion_base, columnas):
+    """
+    TBLPROPERTIES de partition projection: Athena calcula las particiones a
+    partir de la consulta y ya no hace falta registrarlas. columnas:
+    {"anio": {"type": "integer", "range": "2000,2100"}, ...}
+    """
+    propiedades = {"projection.enabled": "true"}
+    for columna, opciones in columnas.items():
+        for opcion, valor in opciones.items():
+            propiedades[f"projection.{columna}.{opcion}"] = valor
+    plantilla = "/".join(f"{columna}=${{{columna}}}" for columna in columnas)
+    propiedades["storage.location.template"] = f"{ubicacion_base.rstrip('/')}/{plantilla}/"
+    return ", ".join(f"'{clave}'='{valor}'" for clave, valor in propiedades.items())
@@ -1,29 +1,626 @@
+import collections
+import functools
+import json
 import os
-import boto3
-from dotenv import load_dotenv
+import random
+import threading
+import time
 
-load_dotenv()
+# boto3, botocore y python-dotenv se importan bajo demanda: importar este módulo
+# (o los scripts que lo usan) no debe pagar la carga de boto3 ni leer el .env.
+_env_loaded = False
 
+# ---------------- POOL DE CLIENTES ---------------- #
+# Un único client/resource por (tipo, servicio, región, credenciales): así se
+# reutilizan las conexiones HTTP (keep-alive) en lugar de repetir el handshake TLS.
+_lock = threading.RLock()
+_sessions = {}
+_registry = {}
+_pool_overrides = {}
+_executor = None
 
-def _build_session():
+# Operaciones de transferencia gestionada de boto3 que no figuran en el modelo del servicio
+_TRANSFER_METHODS = ("upload_file", "download_file", "upload_fileobj", "download_fileobj", "copy")
+
+# ---------------- REINTENTOS Y LIMITACIÓN DE TASA ---------------- #
+# Mismos códigos que botocore considera throttling en su modo de reintentos estándar
+THROTTLE_ERROR_CODES = frozenset((
+    "Throttling", "ThrottlingException", "ThrottledException", "RequestThrottledException",
+    "TooManyRequestsException", "ProvisionedThroughputExceededException",
+    "TransactionInProgressException", "RequestLimitExceeded", "BandwidthLimitExceeded",
+    "LimitExceededException", "RequestThrottled", "SlowDown", "PriorRequestNotComplete",
+    "EC2ThrottledException",
+))
+_rate_limits = {}
+_buckets = {}
+_stats = collections.defaultdict(lambda: {"calls": 0, "retries": 0, "throttles": 0, "errors": 0})
+
+# ---------------- MÉTRICAS POR LLAMADA ---------------- #
+# AWS_METRICS se lee en _load_env() (puede venir del .env) salvo que se llame antes a enable/disable_metrics()
+_metrics_enabled = False
+_metrics_configured = False
+_metrics = {}
+_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _load_env():
+    global _env_loaded, _metrics_enabled
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        if not _metrics_configured:
+            _metrics_enabled = os.getenv("AWS_METRICS", "false").lower() in ("1", "true", "yes")
+        _env_loaded = True
+
+
+def _pool_settings():
+    settings = {
+        "max_pool_connections": int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "50")),
+        "connect_timeout": float(os.getenv("AWS_CONNECT_TIMEOUT", "10")),
+        "read_timeout": float(os.getenv("AWS_READ_TIMEOUT", "60")),
+        "tcp_keepalive": os.getenv("AWS_TCP_KEEPALIVE", "true").lower() in ("1", "true", "yes"),
+    }
+    settings.update(_pool_overrides)
+    return settings
+
+
+def _credentials_key():
+    _load_env()
+    return (
+        os.getenv("ACCESS_KEY"),
+        os.getenv("SECRET_KEY"),
+        os.getenv("SESSION_TOKEN"),
+    )
+
+
+def _region(region_name=None):
+    return region_name or os.getenv("REGION", "us-east-1")
+
+
+def _build_session(region_name=None):
+    import boto3
+
+    access_key, secret_key, session_token = _credentials_key()
     return boto3.session.Session(
-        aws_access_key_id=os.getenv("ACCESS_KEY"),
-        aws_secret_access_key=os.getenv("SECRET_KEY"),
-        aws_session_token=os.getenv("SESSION_TOKEN"),
-        region_name=os.getenv("REGION", "us-east-1")
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        aws_session_token=session_token,
+        region_name=_region(region_name)
+    )
+
+
+def _build_config():
+    from botocore.config import Config
+
+    # Backoff exponencial con jitter de botocore; la ralentización ante throttling
+    # la aplica además el TokenBucket compartido por servicio/API (ver _instrument)
+    retries = {
+        "mode": os.getenv("AWS_RETRY_MODE", "standard"),
+        "max_attempts": int(os.getenv("AWS_MAX_ATTEMPTS", "10")),
+    }
+    return Config(retries=retries, **_pool_settings())
+
+
+class TokenBucket:
+    """Token bucket compartido entre hilos con ajuste adaptativo de la tasa.
+
+    Con ``rate=None`` no limita hasta recibir el primer throttling; a partir de
+    ahí reduce la tasa multiplicativamente en cada throttling y la recupera poco
+    a poco con cada llamada correcta.
+    """
+
+    def __init__(self, rate=None, burst=None, min_rate=0.5, backoff=0.7, recovery=0.02):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.backoff = backoff
+        self.recovery = recovery
+        self._tokens = self._capacity()
+        self._last = time.monotonic()
+        self._sent = collections.deque()
+        self._peak_rate = None
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        if self.rate is None:
+            return 0
+        return self.burst or max(1.0, self.rate)
+
+    def _refill(self, now):
+        capacity = self._capacity()
+        self._tokens = min(capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def measured_rate(self, window=1.0):
+        """Llamadas por segundo enviadas en la última ventana."""
+        with self._lock:
+            now = time.monotonic()
+            while self._sent and now - self._sent[0] > window:
+                self._sent.popleft()
+            return len(self._sent) / window
+
+    def acquire(self):
+        """Bloquea hasta disponer de un token (no espera si el bucket no está limitado)."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._sent.append(now)
+                if len(self._sent) > 10000:
+                    self._sent.popleft()
+                if self.rate is None:
+                    return
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                self._sent.pop()
+                wait = (1 - self._tokens) / self.rate
+            # Jitter para que los hilos en espera no despierten todos a la vez
+            time.sleep(wait * random.uniform(1.0, 1.25))
+
+    def on_throttle(self):
+        measured = self.measured_rate()
+        with self._lock:
+            base = self.rate if self.rate is not None else max(measured, self.min_rate)
+            if self._peak_rate is None or base > self._peak_rate:
+                self._peak_rate = base
+            self.rate = max(self.min_rate, base * self.backoff)
+            self._last = time.monotonic()
+            self._tokens = min(self._tokens, self._capacity())
+
+    def on_success(self):
+        with self._lock:
+            if self.rate is None or self._peak_rate is None:
+                return
+            self._refill(time.monotonic())
+            self.rate += max(self.recovery * self.rate, 0.01)
+            limit = self.max_rate if self.max_rate is not None else self._peak_rate
+            if self.rate >= limit:
+                # Recuperada la tasa previa al throttling: vuelve a la configurada (o a sin límite)
+                self.rate = self.max_rate
+                self._peak_rate = None
+                self._tokens = self._capacity()
+
+
+def configure_rate_limit(service_name, rate, burst=None, operation_name=None):
+    """Limita las llamadas por segundo a un servicio o a una operación concreta (p. ej. "GetQueryExecution").
+
+    ``rate=None`` elimina el límite configurado (el bucket sigue adaptándose ante throttling).
+    """
+    key = (service_name, operation_name)
+    with _lock:
+        _rate_limits[key] = (rate, burst)
+        for bucket_key in [k for k in _buckets if k[0] == service_name and operation_name in (None, k[1])]:
+            del _buckets[bucket_key]
+
+
+def get_rate_limiter(service_name, operation_name):
+    """Devuelve el TokenBucket compartido de una operación (lo crea si no existe)."""
+    key = (service_name, operation_name)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _lock:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                rate, burst = _rate_limits.get(key) or _rate_limits.get((service_name, None)) or (None, None)
+                bucket = TokenBucket(rate, burst)
+                _buckets[key] = bucket
+    return bucket
+
+
+def get_retry_stats():
+    """Contadores de llamadas, reintentos, throttling y errores por "servicio.Operación"."""
+    with _lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+
+def reset_retry_stats():
+    with _lock:
+        _stats.clear()
+
+
+def _operation_from_event(event_name):
+    # "before-send.s3.PutObject" -> "PutObject"
+    return event_name.rsplit(".", 1)[-1]
+
+
+def _instrument(client):
+    """Registra en el client los hooks de botocore de limitación de tasa y contadores."""
+    service_name = client.meta.service_model.service_name
+
+    def before_send(event_name, **kwargs):
+        get_rate_limiter(service_name, _operation_from_event(event_name)).acquire()
+
+    def needs_retry(event_name, response=None, **kwargs):
+        if response is None:
+            return None
+        http_response, parsed = response
+        code = parsed.get("Error", {}).get("Code")
+        if code in THROTTLE_ERROR_CODES or http_response.status_code == 429:
+            operation_name = _operation_from_event(event_name)
+            get_rate_limiter(service_name, operation_name).on_throttle()
+            with _lock:
+                _stats[f"{service_name}.{operation_name}"]["throttles"] += 1
+        # Devolver None deja la decisión de reintentar al handler de botocore
+        return None
+
+    def after_call(event_name, http_response=None, parsed=None, **kwargs):
+        # after-call se emite también para respuestas HTTP de error, antes de lanzar la excepción
+        operation_name = _operation_from_event(event_name)
+        retries = (parsed or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        failed = http_response is not None and http_response.status_code >= 300
+        if not failed:
+            get_rate_limiter(service_name, operation_name).on_success()
+        with _lock:
+            stats = _stats[f"{service_name}.{operation_name}"]
+            stats["calls"] += 1
+            stats["retries"] += retries
+            stats["errors"] += int(failed)
+
+    def after_call_error(event_name, **kwargs):
+        # Errores sin respuesta HTTP (conexión, timeouts) tras agotar los reintentos
+        with _lock:
+            stats = _stats[f"{service_name}.{_operation_from_event(event_name)}"]
+            stats["calls"] += 1
+            stats["errors"] += 1
+
+    events = client.meta.events
+    events.register("before-send", before_send)
+    events.register("needs-retry", needs_retry)
+    events.register("after-call", after_call)
+    events.register("after-call-error", after_call_error)
+    if _metrics_enabled:
+        _register_metrics(client)
+    return client
+
+
+class _Histogram:
+    """Histograma de latencias: muestras recientes (reservorio acotado) más contador y suma totales."""
+
+    def __init__(self, max_samples=10000):
+        self.samples = collections.deque(maxlen=max_samples)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self, quantiles=_QUANTILES):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: None for q in quantiles}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles}
+
+
+class _OperationMetrics:
+    def __init__(self):
+        self.latency = _Histogram()
+        self.status_codes = collections.Counter()
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def snapshot(self):
+        quantiles = self.latency.quantiles()
+        return {
+            "count": self.latency.count,
+            "latency_sum_s": round(self.latency.sum, 6),
+            "latency_p50_s": quantiles[0.5],
+            "latency_p95_s": quantiles[0.95],
+            "latency_p99_s": quantiles[0.99],
+            "status_codes": {str(k): v for k, v in self.status_codes.items()},
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+def _body_length(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    from botocore.utils import determine_content_length
+
+    return determine_content_length(body) or 0
+
+
+def _register_metrics(client):
+    """Registra los hooks de latencia, estado HTTP y bytes por operación."""
+    if getattr(client, "_metrics_registered", False):
+        return
+    client._metrics_registered = True
+    service_name = client.meta.service_model.service_name
+
+    def before_call(context=None, **kwargs):
+        if _metrics_enabled and context is not None:
+            context["metrics_start"] = time.perf_counter()
+            context["metrics_bytes_sent"] = 0
+
+    def before_send(request=None, **kwargs):
+        # Se emite en cada intento: los reintentos también cuentan como bytes enviados
+        context = getattr(request, "context", None)
+        if _metrics_enabled and context is not None and "metrics_start" in context:
+            # Con aws-chunked (checksums de S3) el tamaño real va en X-Amz-Decoded-Content-Length
+            length = request.headers.get("Content-Length") or request.headers.get("X-Amz-Decoded-Content-Length")
+            context["metrics_bytes_sent"] += int(length) if length else _body_length(request.body)
+
+    def record(event_name, context, status, retries=0, bytes_received=0):
+        if not _metrics_enabled or context is None or "metrics_start" not in context:
+            return
+        latency = time.perf_counter() - context.pop("metrics_start")
+        key = (service_name, _operation_from_event(event_name))
+        with _lock:
+            metrics = _metrics.get(key)
+            if metrics is None:
+                metrics = _metrics[key] = _OperationMetrics()
+            metrics.latency.observe(latency)
+            metrics.status_codes[status] += 1
+            metrics.retries += retries
+            metrics.bytes_sent += context.pop("metrics_bytes_sent", 0)
+            metrics.bytes_received += bytes_received
+
+    def after_call(event_name, http_response=None, parsed=None, context=None, model=None, **kwargs):
+        metadata = (parsed or {}).get("ResponseMetadata", {})
+        # En una respuesta HEAD content-length es el tamaño del objeto, no lo recibido: no llega cuerpo
+        is_head = model is not None and model.http.get("method") == "HEAD"
+        length = http_response.headers.get("content-length") if http_response is not None and not is_head else None
+        status = http_response.status_code if http_response is not None else "unknown"
+        record(event_name, context, status, metadata.get("RetryAttempts", 0), int(length or 0))
+
+    def after_call_error(event_name, context=None, **kwargs):
+        record(event_name, context, "error")
+
+    events = client.meta.events
+    events.register("before-call", before_call)
+    events.register("before-send", before_send)
+    events.register("after-call", after_call)
+    events.register("after-call-error", after_call_error)
+
+
+def enable_metrics():
+    """Activa la recogida de métricas por llamada en todos los clients (también los ya creados)."""
+    global _metrics_enabled, _metrics_configured
+    with _lock:
+        _metrics_enabled = _metrics_configured = True
+        for (kind, _, _, _), obj in _registry.items():
+            _register_metrics(obj if kind == "client" else obj.meta.client)
+
+
+def disable_metrics():
+    global _metrics_enabled, _metrics_configured
+    _metrics_enabled = False
+    _metrics_configured = True
+
+
+def reset_metrics():
+    with _lock:
+        _metrics.clear()
+
+
+def get_metrics():
+    """Devuelve las métricas agregadas por "servicio.Operación"."""
+    with _lock:
+        return {f"{service}.{operation}": m.snapshot() for (service, operation), m in _metrics.items()}
+
+
+def export_metrics_json(indent=2):
+    return json.dumps(get_metrics(), indent=indent, sort_keys=True)
+
+
+def export_metrics_prometheus():
+    """Exporta las métricas en formato de texto de Prometheus (latencias como summary)."""
+    with _lock:
+        items = sorted(
+            ((service, operation, m.snapshot(), m.latency.quantiles()) for (service, operation), m in _metrics.items()),
+            key=lambda item: item[:2]
+        )
+
+    lines = [
+        "# HELP aws_api_call_latency_seconds Latencia de las llamadas a la API de AWS (incluye reintentos).",
+        "# TYPE aws_api_call_latency_seconds summary",
+    ]
+    for service, operation, snap, quantiles in items:
+        labels = f'service="{service}",operation="{operation}"'
+        for q, value in quantiles.items():
+            if value is not None:
+                lines.append(f'aws_api_call_latency_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+        lines.append(f"aws_api_call_latency_seconds_sum{{{labels}}} {snap['latency_sum_s']}")
+        lines.append(f"aws_api_call_latency_seconds_count{{{labels}}} {snap['count']}")
+
+    counters = (
+        ("aws_api_calls_total", "Llamadas por código de estado HTTP.", None),
+        ("aws_api_retries_total", "Reintentos realizados por botocore.", "retries"),
+        ("aws_api_request_bytes_total", "Bytes enviados en las peticiones.", "bytes_sent"),
+        ("aws_api_response_bytes_total", "Bytes recibidos en las respuestas.", "bytes_received"),
     )
+    for name, help_text, field in counters:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for service, operation, snap, _ in items:
+            labels = f'service="{service}",operation="{operation}"'
+            if field is None:
+                for status, count in sorted(snap["status_codes"].items()):
+                    lines.append(f'{name}{{{labels},status="{status}"}} {count}')
+            else:
+                lines.append(f"{name}{{{labels}}} {snap[field]}")
+    return "\n".join(lines) + "\n"
+
+
+def _get_session(region_name, credentials):
+    key = (region_name, credentials)
+    session = _sessions.get(key)
+    if session is None:
+        session = _build_session(region_name)
+        _sessions[key] = session
+    return session
+
+
+def _get_or_create(kind, service_name, region_name=None):
+    _load_env()
+    region_name = _region(region_name)
+    credentials = _credentials_key()
+    key = (kind, service_name, region_name, credentials)
+
+    obj = _registry.get(key)
+    if obj is not None:
+        return obj
+
+    with _lock:
+        obj = _registry.get(key)
+        if obj is None:
+            session = _get_session(region_name, credentials)
+            if kind == "client":
+                obj = _instrument(session.client(service_name, config=_build_config()))
+            else:
+                obj = session.resource(service_name, config=_build_config())
+                _instrument(obj.meta.client)
+            _registry[key] = obj
+    return obj
+
+
+def _close(kind, obj):
+    client = obj if kind == "client" else obj.meta.client
+    try:
+        client.close()
+    except Exception:
+        pass
+
+
+def configure_pool(max_pool_connections=None, connect_timeout=None, read_timeout=None, tcp_keepalive=None):
+    """Ajusta el pool HTTP de los clients. Los clients ya creados se cierran y se recrean bajo demanda."""
+    changes = {
+        "max_pool_connections": max_pool_connections,
+        "connect_timeout": connect_timeout,
+        "read_timeout": read_timeout,
+        "tcp_keepalive": tcp_keepalive,
+    }
+    with _lock:
+        _pool_overrides.update({k: v for k, v in changes.items() if v is not None})
+    close_clients()
+
+
+def refresh_clients(service_name=None):
+    """Descarta los clients/resources cacheados (p. ej. tras rotar credenciales en el .env)."""
+    close_clients(service_name)
+    if service_name is None:
+        with _lock:
+            _sessions.clear()
+
+
+def close_clients(service_name=None):
+    """Cierra las conexiones de los clients cacheados y los elimina del registro."""
+    with _lock:
+        keys = [k for k in _registry if service_name is None or k[1] == service_name]
+        cerrados = [(k[0], _registry.pop(k)) for k in keys]
+    for kind, obj in cerrados:
+        _close(kind, obj)
+
+
+class LazyClient:
+    """Proxy que resuelve el client/resource compartido en el primer acceso a un atributo."""
+
+    def __init__(self, service_name, kind="client", region_name=None):
+        self._service_name = service_name
+        self._kind = kind
+        self._region_name = region_name
+
+    def _resolve(self):
+        # Se consulta el registro en cada acceso para respetar refresh_clients()/close_clients()
+        return _get_or_create(self._kind, self._service_name, self._region_name)
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __repr__(self):
+        return f"<LazyClient {self._kind} '{self._service_name}'>"
+
+
+def lazy_client(service_name, region_name=None):
+    """Devuelve un proxy del client que no carga boto3 hasta que se usa."""
+    return LazyClient(service_name, "client", region_name)
+
+
+def lazy_resource(service_name, region_name=None):
+    """Devuelve un proxy del resource que no carga boto3 hasta que se usa."""
+    return LazyClient(service_name, "resource", region_name)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                # Por defecto tantos hilos como conexiones tiene el pool: más hilos solo esperarían conexión
+                max_workers = int(os.getenv("AWS_ASYNC_MAX_WORKERS", _pool_settings()["max_pool_connections"]))
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aws-async")
+    return _executor
+
+
+def shutdown_executor(wait=True):
+    """Detiene el executor compartido de la fachada asyncio (se recrea en el siguiente uso)."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+class AsyncClient:
+    """Fachada asyncio sobre el client compartido: cada operación devuelve un awaitable."""
+
+    def __init__(self, service_name, region_name=None):
+        self._client = LazyClient(service_name, "client", region_name)
+
+    async def run(self, func, *args, **kwargs):
+        """Ejecuta cualquier llamada bloqueante (p. ej. Body.read()) en el executor acotado."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+    async def paginate(self, operation_name, **kwargs):
+        """Recorre un paginador de boto3 sin bloquear el bucle de eventos, página a página."""
+        pages = iter(self._client.get_paginator(operation_name).paginate(**kwargs))
+        while True:
+            page = await self.run(next, pages, None)
+            if page is None:
+                return
+            yield page
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self._client.meta.method_to_api_mapping and name not in _TRANSFER_METHODS:
+            return attr
+
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    def __repr__(self):
+        return f"<AsyncClient '{self._client._service_name}'>"
+
+
+def get_async_client(service_name, region_name=None):
+    """Devuelve una fachada asyncio del client (p. ej. await get_async_client("s3").head_object(...))."""
+    return AsyncClient(service_name, region_name)
 
 
-def get_client(service_name):
-    """Devuelve un cliente boto3 para el servicio solicitado usando .env o credenciales del entorno."""
-    session = _build_session()
-    return session.client(service_name)
+def get_client(service_name, region_name=None):
+    """Devuelve un cliente boto3 compartido para el servicio solicitado usando .env o credenciales del entorno."""
+    return _get_or_create("client", service_name, region_name)
 
 
-def get_resource(service_name):
-    """Devuelve un resource boto3 para el servicio solicitado."""
-    session = _build_session()
-    return session.resource(service_name)
+def get_resource(service_name, region_name=None):
+    """Devuelve un resource boto3 compartido para el servicio solicitado."""
+    return _get_or_create("resource", service_name, region_name)
 
 
 def get_ec2_client():
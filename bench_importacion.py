@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+# ---------------- CONFIGURACIÓN ---------------- #
+# Módulos que deben importarse sin cargar boto3/faker ni crear clientes
+MODULOS = [
+    "aws_session",
+    "S3_operaciones",
+    "athena_operaciones",
+    "z_apartado1",
+    "z_apartado2",
+    "z_apartado3",
+    "z_apartado7",
+    "z_apartado10",
+    "z_apartado11",
+    "z_apartado12",
+]
+LIMITE_MS = float(os.getenv("BENCH_IMPORT_LIMITE_MS", "150"))
+REPETICIONES = 3
+
+# ---------------- FUNCIONES ---------------- #
+
+def medir_importacion(modulo):
+    """Devuelve el tiempo acumulado (ms) de importar el módulo en un intérprete limpio"""
+    codigo = (
+        f"import {modulo}, sys; "
+        "pesados = [m for m in ('boto3', 'faker') if m in sys.modules]; "
+        "assert not pesados, f'importado al cargar el módulo: {pesados}'"
+    )
+    resultado = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if resultado.returncode != 0:
+        raise AssertionError(f"{modulo}: {resultado.stderr.strip().splitlines()[-1]}")
+
+    # La última línea de -X importtime corresponde al propio módulo (tiempo acumulado en µs)
+    for linea in reversed(resultado.stderr.splitlines()):
+        partes = linea.split("|")
+        if len(partes) == 3 and partes[2].strip() == modulo:
+            return int(partes[1]) / 1000
+    raise AssertionError(f"{modulo}: no se encontró en la salida de -X importtime")
+
+
+def main():
+    print(f"🚀 BENCHMARK DE IMPORTACIÓN (límite {LIMITE_MS:.0f} ms)\n")
+    fallos = []
+    for modulo in MODULOS:
+        tiempo = min(medir_importacion(modulo) for _ in range(REPETICIONES))
+        estado = "✅" if tiempo <= LIMITE_MS else "❌"
+        print(f"{estado} {modulo}: {tiempo:.1f} ms")
+        if tiempo > LIMITE_MS:
+            fallos.append(modulo)
+
+    assert not fallos, f"Importación por encima de {LIMITE_MS:.0f} ms: {fallos}"
+    print("\n🎉 BENCHMARK DE IMPORTACIÓN SUPERADO")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 import time
-from aws_session import get_ec2_resource, get_ec2_client
+from aws_session import lazy_resource, lazy_client
 from botocore.exceptions import ClientError
 
-ec2 = get_ec2_resource()
-client = get_ec2_client()
+ec2 = lazy_resource("ec2")
+client = lazy_client("ec2")
 
 
 def crear_instancia(nombre, key_name="MiKeyPair"):
@@ -1,29 +1,29 @@
 import time
-import csv
-from faker import Faker
-from aws_session import get_athena_client, get_s3_client
+from aws_session import lazy_client
+from athena_operaciones import CacheResultadosAthena, EjecutorAthena, comparar_escaneo, convertir_tabla_ctas
+from S3_operaciones import ClienteS3ConCache, eliminar_prefijo, subir_registros_stream
 
 # ---------------- CONFIGURACIÓN ---------------- #
 DATABASE = 'mi_basedatos'
 BUCKET = 'mibuckeriaricardoathena'
 TABLE_NAME = 'mi_tabla_csv'
-CSV_LOCAL = "datos.csv"
-CSV_S3_KEY = "datos.csv"
+TABLE_PARQUET = f"{TABLE_NAME}_parquet"
+CSV_S3_KEY = "datos/datos.csv"
 OUTPUT = f"s3://{BUCKET}/resultados/"
+PARQUET_LOCATION = f"s3://{BUCKET}/parquet/{TABLE_NAME}/"
 
 # ---------------- CLIENTES AWS ---------------- #
-s3 = get_s3_client()
-athena = get_athena_client()
+s3 = ClienteS3ConCache(lazy_client("s3"))
+athena = lazy_client("athena")
+ejecutor = EjecutorAthena(athena, s3_client=s3, database=DATABASE, output_location=OUTPUT)
+cache_athena = CacheResultadosAthena(ejecutor)
 
 # ---------------- FUNCIONES ---------------- #
 
 def limpiar_resultados_anteriores():
-    """Eliminar resultados antiguos de Athena en el bucket"""
-    response = s3.list_objects_v2(Bucket=BUCKET, Prefix='resultados/')
-    if 'Contents' in response:
-        for obj in response['Contents']:
-            s3.delete_object(Bucket=BUCKET, Key=obj['Key'])
-    print("✅ Resultados antiguos eliminados")
+    """Eliminar resultados antiguos de Athena en el bucket (todas las páginas, en lotes de 1000)"""
+    resultado = eliminar_prefijo(s3, BUCKET, 'resultados/')
+    print(f"✅ Resultados antiguos eliminados ({resultado['eliminados']} objetos)")
 
 def crear_bucket_si_no_existe():
     """Crea bucket si no existe"""
@@ -34,40 +34,28 @@ def crear_bucket_si_no_existe():
         s3.create_bucket(Bucket=BUCKET)
         print(f"Bucket '{BUCKET}' creado.")
 
-def generar_csv():
-    """Genera CSV de prueba y lo sube a S3"""
+def generar_csv(num_filas=200):
+    """Genera CSV de prueba y lo sube a S3 en streaming (sin archivo local)"""
+    from faker import Faker  # import diferido: solo lo necesita la generación de datos
+
     fake = Faker()
-    with open(CSV_LOCAL, mode='w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['id', 'nombre', 'edad'])
-        for i in range(1, 201):
-            writer.writerow([i, fake.name(), fake.random_int(18, 80)])
-    s3.upload_file(Filename=CSV_LOCAL, Bucket=BUCKET, Key=CSV_S3_KEY)
+    filas = ([i, fake.name(), fake.random_int(18, 80)] for i in range(1, num_filas + 1))
+    subir_registros_stream(s3, BUCKET, CSV_S3_KEY, filas, formato="csv", cabecera=['id', 'nombre', 'edad'])
     print(f"CSV de prueba generado y subido a s3://{BUCKET}/{CSV_S3_KEY}")
 
 def ejecutar_query(query, database=DATABASE):
     """Ejecuta query en Athena y espera a que termine"""
-    response = athena.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={'Database': database},
-        ResultConfiguration={'OutputLocation': OUTPUT}
-    )
-    qid = response['QueryExecutionId']
-    while True:
-        st = athena.get_query_execution(QueryExecutionId=qid)['QueryExecution']['Status']
-        if st['State'] in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
-            break
-        time.sleep(1)
-    if st['State'] != 'SUCCEEDED':
-        print(f"❌ Error en query: {st['State']} - {st.get('StateChangeReason')}")
-        return None
-    return athena.get_query_results(QueryExecutionId=qid)
+    return cache_athena.resultados(cache_athena.enviar(query, database=database))
+
+def ejecutar_queries(queries, database=DATABASE):
+    """Lanza todas las queries a la vez y devuelve sus resultados en el mismo orden"""
+    return [cache_athena.resultados(f) for f in cache_athena.enviar_varias(queries, database=database)]
 
 def mostrar_resultados(resultados):
     if not resultados:
         return
-    for row in resultados['ResultSet']['Rows']:
-        print([col.get('VarCharValue', '') for col in row['Data']])
+    for fila in resultados:
+        print(fila)
 
 def crear_base_datos():
     ejecutar_query(f"CREATE DATABASE IF NOT EXISTS {DATABASE};")
@@ -86,12 +74,23 @@ def crear_tabla():
         'quoteChar' = '"',
         'use.null.for.invalid.data' = 'true'
     )
-    LOCATION 's3://{BUCKET}/'
+    LOCATION 's3://{BUCKET}/datos/'
     TBLPROPERTIES ('skip.header.line.count'='1');
     """
     ejecutar_query(query)
+    # Tablas creadas antes apuntaban a la raíz del bucket, donde también hay resultados y Parquet
+    ejecutar_query(f"ALTER TABLE {TABLE_NAME} SET LOCATION 's3://{BUCKET}/datos/';")
     print(f"✅ Tabla '{TABLE_NAME}' creada o ya existía")
 
+def convertir_a_parquet():
+    """Crea la versión Parquet de la tabla (CTAS) y compara lo que escanea cada una"""
+    convertir_tabla_ctas(ejecutor, TABLE_NAME, TABLE_PARQUET, PARQUET_LOCATION)
+    comparar_escaneo(
+        ejecutor,
+        f"SELECT AVG(edad) AS edad_promedio FROM {TABLE_NAME};",
+        f"SELECT AVG(edad) AS edad_promedio FROM {TABLE_PARQUET};"
+    )
+
 # ---------------- MAIN ---------------- #
 
 if __name__ == "__main__":
@@ -104,14 +103,17 @@ if __name__ == "__main__":
     crear_tabla()
     time.sleep(2)  # Pequeña pausa para asegurar que todo esté listo
     
-    print("\n--- CONSULTA 1: Contar todas las entradas de la base de datos ---")
-    mostrar_resultados(ejecutar_query(f"SELECT COUNT(*) FROM {TABLE_NAME};"))
-
-    print("\n--- CONSULTA 2: Consulta simple para listar las personas con mas de 30 ---")
-    mostrar_resultados(ejecutar_query(f"SELECT * FROM {TABLE_NAME} WHERE edad > 30;"))
-
-    print("\n--- CONSULTA 3: Promedio de edades de las personas ---")
-    mostrar_resultados(ejecutar_query(f"SELECT AVG(edad) AS edad_promedio FROM {TABLE_NAME};"))
-
+    # Las tres consultas son independientes: se lanzan a la vez
+    consultas = {
+        "--- CONSULTA 1: Contar todas las entradas de la base de datos ---": f"SELECT COUNT(*) FROM {TABLE_NAME};",
+        "--- CONSULTA 2: Consulta simple para listar las personas con mas de 30 ---": f"SELECT * FROM {TABLE_NAME} WHERE edad > 30;",
+        "--- CONSULTA 3: Promedio de edades de las personas ---": f"SELECT AVG(edad) AS edad_promedio FROM {TABLE_NAME};",
+    }
+    for titulo, resultados in zip(consultas, ejecutar_queries(list(consultas.values()))):
+        print(f"\n{titulo}")
+        mostrar_resultados(resultados)
+
+    print("\n--- PARQUET: conversión de la tabla y bytes escaneados ---")
+    convertir_a_parquet()
 
     print("\n🎉 PROCESO ATHENA FINALIZADO")
\ No newline at end of file
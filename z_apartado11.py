@@ -1,13 +1,14 @@
 import time
 import os
-import json
-from faker import Faker
-from aws_session import get_athena_client, get_s3_client
+from aws_session import lazy_client
+from athena_operaciones import CacheResultadosAthena, EjecutorAthena, comparar_escaneo, convertir_tabla_ctas
+from S3_operaciones import ClienteS3ConCache, subir_registros_stream
 
 # ---------------- CONFIGURACIÓN ---------------- #
 DATABASE_JSON = 'mi_basedatos_json'
 BUCKET_JSON = 'mibuckeriaricardoathenajson'
 TABLE_JSON = 'mi_tabla_json'
+TABLE_JSON_PARQUET = f"{TABLE_JSON}_parquet"
 
 TIMESTAMP_JSON = int(time.time())
 DATA_FOLDER_JSON = f"datos_json_{TIMESTAMP_JSON}"
@@ -16,10 +17,13 @@ RESULT_FOLDER_JSON = f"resultados_json_{TIMESTAMP_JSON}"
 JSON_LOCAL = "datos.json"
 JSON_S3_PATH = f"s3://{BUCKET_JSON}/{DATA_FOLDER_JSON}/datos.json"
 OUTPUT_JSON = f"s3://{BUCKET_JSON}/{RESULT_FOLDER_JSON}/"
+PARQUET_LOCATION_JSON = f"s3://{BUCKET_JSON}/parquet/{TABLE_JSON}/"
 
 # ---------------- CLIENTES AWS ---------------- #
-s3 = get_s3_client()
-athena = get_athena_client()
+s3 = ClienteS3ConCache(lazy_client("s3"))
+athena = lazy_client("athena")
+ejecutor = EjecutorAthena(athena, s3_client=s3, database=DATABASE_JSON, output_location=OUTPUT_JSON)
+cache_athena = CacheResultadosAthena(ejecutor)
 
 # ---------------- FUNCIONES ---------------- #
 
@@ -37,52 +41,37 @@ def crear_bucket_si_no_existe():
                              CreateBucketConfiguration={'LocationConstraint': region})
         print(f"Bucket '{BUCKET_JSON}' creado.")
 
-def generar_json():
-    """Genera archivo JSON de prueba y lo sube a S3"""
+def generar_json(num_registros=200):
+    """Genera JSON de prueba (un objeto por línea) y lo sube a S3 en streaming"""
+    from faker import Faker  # import diferido: solo lo necesita la generación de datos
+
     fake = Faker()
-    os.makedirs(DATA_FOLDER_JSON, exist_ok=True)
-    local_path = os.path.join(DATA_FOLDER_JSON, JSON_LOCAL)
-    data = []
-    for i in range(1, 201):
-        data.append({
+    registros = (
+        {
             "id": i,
             "nombre": fake.name(),
             "edad": fake.random_int(min=18, max=80),
             "ciudad": fake.city()
-        })
-    with open(local_path, "w", encoding="utf-8") as f:
-        for record in data:
-            f.write(json.dumps(record) + "\n")  # JSON por línea
-    s3.upload_file(Filename=local_path, Bucket=BUCKET_JSON, Key=f"{DATA_FOLDER_JSON}/{JSON_LOCAL}")
+        }
+        for i in range(1, num_registros + 1)
+    )
+    subir_registros_stream(s3, BUCKET_JSON, f"{DATA_FOLDER_JSON}/{JSON_LOCAL}", registros, formato="ndjson")
     print(f"JSON de prueba generado y subido a s3://{BUCKET_JSON}/{DATA_FOLDER_JSON}/{JSON_LOCAL}")
 
 def ejecutar_query(query, database=DATABASE_JSON):
     """Ejecuta query en Athena y espera a que termine"""
-    response = athena.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={'Database': database},
-        ResultConfiguration={'OutputLocation': OUTPUT_JSON}
-    )
-    qid = response['QueryExecutionId']
-    while True:
-        st = athena.get_query_execution(QueryExecutionId=qid)['QueryExecution']['Status']
-        state = st['State']
-        if state in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
-            break
-        time.sleep(1)
-    if state != 'SUCCEEDED':
-        reason = st.get('StateChangeReason')
-        print(f"❌ Error en query: {state} - {reason}")
-        return None
-    return athena.get_query_results(QueryExecutionId=qid)
+    return cache_athena.resultados(cache_athena.enviar(query, database=database))
+
+def ejecutar_queries(queries, database=DATABASE_JSON):
+    """Lanza todas las queries a la vez y devuelve sus resultados en el mismo orden"""
+    return [cache_athena.resultados(f) for f in cache_athena.enviar_varias(queries, database=database)]
 
 def mostrar_resultados(resultados):
     """Imprime resultados legibles"""
     if not resultados:
         return
-    for row in resultados['ResultSet']['Rows']:
-        valores = [col.get('VarCharValue', '') for col in row['Data']]
-        print(valores)
+    for fila in resultados:
+        print(fila)
 
 def crear_base_datos_json():
     query = f"CREATE DATABASE IF NOT EXISTS {DATABASE_JSON};"
@@ -105,6 +94,15 @@ def crear_tabla_json():
     ejecutar_query(query)
     print(f"✅ Tabla '{TABLE_JSON}' creada o ya existía")
 
+def convertir_a_parquet():
+    """Crea la versión Parquet de la tabla JSON (CTAS) y compara lo que escanea cada una"""
+    convertir_tabla_ctas(ejecutor, TABLE_JSON, TABLE_JSON_PARQUET, PARQUET_LOCATION_JSON)
+    comparar_escaneo(
+        ejecutor,
+        f"SELECT ciudad, COUNT(*) as total FROM {TABLE_JSON} GROUP BY ciudad;",
+        f"SELECT ciudad, COUNT(*) as total FROM {TABLE_JSON_PARQUET} GROUP BY ciudad;"
+    )
+
 # ---------------- MAIN ---------------- #
 
 if __name__ == "__main__":
@@ -115,19 +113,17 @@ if __name__ == "__main__":
     crear_base_datos_json()
     crear_tabla_json()
 
-    # 1️⃣ Consulta: todos los datos
-    print("\n--- CONSULTA 1: TODOS LOS DATOS ---")
-    res1 = ejecutar_query(f"SELECT * FROM {TABLE_JSON} LIMIT 15;")
-    mostrar_resultados(res1)
-
-    # 2️⃣ Consulta: edad > 30
-    print("\n--- CONSULTA 2: edad > 30 ---")
-    res2 = ejecutar_query(f"SELECT * FROM {TABLE_JSON} WHERE edad > 50 LIMIT 10;")
-    mostrar_resultados(res2)
-
-    # 3️⃣ Consulta: conteo por ciudad
-    print("\n--- CONSULTA 3: Conteo por ciudad ---")
-    res3 = ejecutar_query(f"SELECT ciudad, COUNT(*) as total FROM {TABLE_JSON} GROUP BY ciudad LIMIT 5;")
-    mostrar_resultados(res3)
+    # Las tres consultas son independientes: se lanzan a la vez
+    consultas = {
+        "--- CONSULTA 1: TODOS LOS DATOS ---": f"SELECT * FROM {TABLE_JSON} LIMIT 15;",
+        "--- CONSULTA 2: edad > 30 ---": f"SELECT * FROM {TABLE_JSON} WHERE edad > 50 LIMIT 10;",
+        "--- CONSULTA 3: Conteo por ciudad ---": f"SELECT ciudad, COUNT(*) as total FROM {TABLE_JSON} GROUP BY ciudad LIMIT 5;",
+    }
+    for titulo, resultados in zip(consultas, ejecutar_queries(list(consultas.values()))):
+        print(f"\n{titulo}")
+        mostrar_resultados(resultados)
+
+    print("\n--- PARQUET: conversión de la tabla y bytes escaneados ---")
+    convertir_a_parquet()
 
     print("\n🎉 PROCESO ATHENA CON JSON FINALIZADO")
\ No newline at end of file
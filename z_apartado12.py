@@ -1,7 +1,7 @@
-import time
-import csv
 import os
-from aws_session import get_s3_client, get_athena_client
+from aws_session import lazy_client
+from athena_operaciones import CacheResultadosAthena, EjecutorAthena, propiedades_proyeccion, registrar_particiones
+from S3_operaciones import ClienteS3ConCache, subir_registros_stream
 
 # ---------------- CONFIGURACIÓN ---------------- #
 BUCKET = 'mibuckeriaricardoathenacolumnaparticionada'                  
@@ -9,10 +9,18 @@ PARTICIONES_PATH = 'particiones'
 OUTPUT = f's3://{BUCKET}/resultados/'
 DATABASE = 'mi_basedatos_particion'
 TABLE_NAME = 'mi_tabla_particion'
+UBICACION_PARTICIONES = f's3://{BUCKET}/{PARTICIONES_PATH}/'
+# Con ATHENA_PROYECCION=1 la tabla usa partition projection y no hace falta registrar particiones
+USAR_PROYECCION = os.getenv('ATHENA_PROYECCION', '0') == '1'
+PROYECCION = {'anio': {'type': 'integer', 'range': '2000,2100'}}
 
 # ---------------- CLIENTES ---------------- #
-s3 = get_s3_client()
-athena = get_athena_client()
+s3 = ClienteS3ConCache(lazy_client("s3"))
+athena = lazy_client("athena")
+# Particiones escritas por subir_csv_particion pendientes de registrar en el catálogo
+particiones_nuevas = []
+ejecutor = EjecutorAthena(athena, s3_client=s3, database=DATABASE, output_location=OUTPUT)
+cache_athena = CacheResultadosAthena(ejecutor)
 
 
 def ensure_bucket_exists(bucket):
@@ -35,46 +43,23 @@ def ensure_bucket_exists(bucket):
 
 # ---------------- FUNCIONES ---------------- #
 
-def crear_csv_local(nombre_archivo, datos):
-    """Crea un CSV local con los datos proporcionados"""
-    with open(nombre_archivo, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['id', 'nombre', 'edad'])
-        writer.writerows(datos)
-    print(f"✅ CSV creado: {nombre_archivo}")
-
-def subir_csv_particion(bucket, archivo_local, anio):
-    """Sube CSV a S3 dentro de la carpeta de partición anio=xxxx"""
-    key = f'{PARTICIONES_PATH}/anio={anio}/{archivo_local}'
-    s3.upload_file(archivo_local, bucket, key)
+def subir_csv_particion(bucket, nombre_archivo, anio, datos):
+    """Genera el CSV en memoria y lo sube en streaming a la carpeta de partición anio=xxxx"""
+    key = f'{PARTICIONES_PATH}/anio={anio}/{nombre_archivo}'
+    subir_registros_stream(s3, bucket, key, datos, formato="csv", cabecera=['id', 'nombre', 'edad'])
+    particiones_nuevas.append({'anio': anio})
     print(f"✅ Subido a S3: {key}")
 
 def ejecutar_query(query, database=DATABASE):
     """Ejecuta query en Athena y espera a que termine"""
-    response = athena.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={'Database': database},
-        ResultConfiguration={'OutputLocation': OUTPUT}
-    )
-    qid = response['QueryExecutionId']
-    while True:
-        st = athena.get_query_execution(QueryExecutionId=qid)['QueryExecution']['Status']
-        state = st['State']
-        if state in ['SUCCEEDED','FAILED','CANCELLED']:
-            break
-        time.sleep(1)
-    if state != 'SUCCEEDED':
-        reason = st.get('StateChangeReason', '')
-        print(f"❌ Error en query: {state} - {reason}")
-        return None
-    return athena.get_query_results(QueryExecutionId=qid)
+    return cache_athena.resultados(cache_athena.enviar(query, database=database))
 
 def mostrar_resultados(resultados):
     """Imprime resultados legibles"""
     if not resultados:
         return
-    for row in resultados['ResultSet']['Rows']:
-        print([col.get('VarCharValue','') for col in row['Data']])
+    for fila in resultados:
+        print(fila)
 
 def crear_base_datos():
     q = f"CREATE DATABASE IF NOT EXISTS {DATABASE};"
@@ -95,16 +80,22 @@ def crear_tabla_particionada():
         'quoteChar' = '"',
         'use.null.for.invalid.data'='true'
     )
-    LOCATION 's3://{BUCKET}/{PARTICIONES_PATH}/'
+    LOCATION '{UBICACION_PARTICIONES}'
     TBLPROPERTIES ('skip.header.line.count'='1');
     """
     ejecutar_query(query)
+    if USAR_PROYECCION:
+        ejecutar_query(f"ALTER TABLE {TABLE_NAME} SET TBLPROPERTIES ({propiedades_proyeccion(UBICACION_PARTICIONES, PROYECCION)});")
     print(f"✅ Tabla particionada '{TABLE_NAME}' creada o ya existía")
 
 def agregar_particiones():
-    query = f"MSCK REPAIR TABLE {TABLE_NAME};"
-    ejecutar_query(query)
-    print("✅ Particiones cargadas en Athena")
+    """Registra solo las particiones recién subidas (sin MSCK REPAIR, que recorre todo el prefijo)"""
+    if USAR_PROYECCION:
+        print("✅ Partition projection activo: no hay particiones que registrar")
+        return
+    total = registrar_particiones(ejecutor, TABLE_NAME, UBICACION_PARTICIONES, particiones_nuevas)
+    particiones_nuevas.clear()
+    print(f"✅ {total} particiones registradas en Athena")
 
 # ---------------- MAIN ---------------- #
 if __name__ == "__main__":
@@ -113,15 +104,12 @@ if __name__ == "__main__":
     # Asegurar que el bucket existe
     ensure_bucket_exists(BUCKET)
 
-    # 1️⃣ Crear CSVs locales y subirlos a S3 por partición
+    # 1️⃣ Generar los CSVs y subirlos a S3 por partición (sin archivos locales)
     datos_2023 = [[1,'Ana',30],[2,'Luis',25]]
     datos_2024 = [[3,'Carlos',40],[4,'Laura',28]]
 
-    crear_csv_local('datos_2023.csv', datos_2023)
-    crear_csv_local('datos_2024.csv', datos_2024)
-
-    subir_csv_particion(BUCKET, 'datos_2023.csv', 2023)
-    subir_csv_particion(BUCKET, 'datos_2024.csv', 2024)
+    subir_csv_particion(BUCKET, 'datos_2023.csv', 2023, datos_2023)
+    subir_csv_particion(BUCKET, 'datos_2024.csv', 2024, datos_2024)
 
     # 2️⃣ Crear base de datos y tabla
     crear_base_datos()
@@ -2,15 +2,15 @@ import os
 import subprocess
 import getpass
 import time
-from aws_session import get_ec2_resource, get_ec2_client, get_efs_client
+from aws_session import lazy_resource, lazy_client
 from botocore.exceptions import ClientError
 
 # -----------------------------
-# Recursos AWS
+# Recursos AWS (se crean en el primer uso)
 # -----------------------------
-ec2 = get_ec2_resource()
-client = get_ec2_client()
-efs_client = get_efs_client()
+ec2 = lazy_resource("ec2")
+client = lazy_client("ec2")
+efs_client = lazy_client("efs")
 
 # -----------------------------
 # Key Pair
@@ -25,7 +25,8 @@ def main():
         s3_client,
         BUCKET_NAME,
         ARCHIVO_CSV,
-        CARPETAS
+        CARPETAS,
+        fan_out=True
     )
     descargar_objeto(
         s3_client,
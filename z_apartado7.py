@@ -1,14 +1,11 @@
 import os
-from dotenv import load_dotenv
-from aws_session import get_s3_client
+from aws_session import lazy_client
+from S3_operaciones import ClienteS3ConCache, bucket_existe, descargar_con_cache, seguir_restauraciones
 import csv
-import time
-
-# ---------------- CARGAR CREDENCIALES ---------------- #
-load_dotenv()  # lee el archivo .env
 
 # ---------------- CLIENTE S3 ---------------- #
-s3_client = get_s3_client()
+# aws_session carga el archivo .env al crear el cliente en su primer uso
+s3_client = ClienteS3ConCache(lazy_client("s3"))
 
 # ---------------- CONFIGURACIÓN DEL SCRIPT ---------------- #
 BUCKET_NAME = "mi-bucket-glacier-123456"  # cambia a tu bucket
@@ -56,22 +53,16 @@ def restaurar_objeto_glacier():
 
 def esperar_restauracion():
     print("🔹 [5/6] Esperando a que el objeto esté restaurado...")
-    while True:
-        obj = s3_client.head_object(Bucket=BUCKET_NAME, Key=KEY_S3)
-        restore = obj.get("Restore")
-        if restore:
-            if 'ongoing-request="false"' in restore:
-                print("✅ Objeto restaurado y listo para descargar\n")
-                break
-            else:
-                print(f"⏳ Restauración en curso... ({restore})")
-        else:
-            print("⏳ Restauración no iniciada todavía...")
-        time.sleep(WAIT_INTERVAL)
+    desaparecidas = []
+    for _ in seguir_restauraciones(s3_client, BUCKET_NAME, [KEY_S3], intervalo_min=WAIT_INTERVAL,
+                                   desaparecidas=desaparecidas):
+        print("✅ Objeto restaurado y listo para descargar\n")
+    if desaparecidas:
+        raise FileNotFoundError(f"'{KEY_S3}' no existe en el bucket '{BUCKET_NAME}'")
 
 def descargar_objeto():
     print("🔹 [6/6] Descargando objeto...")
-    s3_client.download_file(BUCKET_NAME, KEY_S3, "datos_glacier_descargado.csv")
+    descargar_con_cache(s3_client, BUCKET_NAME, KEY_S3, "datos_glacier_descargado.csv")
     print("✅ Descarga completada: 'datos_glacier_descargado.csv'\n")
 
 # ---------------- MAIN ---------------- #
@@ -83,8 +74,11 @@ def main():
     print("✅ Conexión con S3 establecida\n")
 
     print(f"🔹 [2/6] Creando bucket '{BUCKET_NAME}' si no existe...")
-    s3_client.create_bucket(Bucket=BUCKET_NAME)
-    print(f"✅ Bucket '{BUCKET_NAME}' creado correctamente\n")
+    if bucket_existe(s3_client, BUCKET_NAME):
+        print(f"✅ Bucket '{BUCKET_NAME}' ya existe\n")
+    else:
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        print(f"✅ Bucket '{BUCKET_NAME}' creado correctamente\n")
 
     crear_csv_local()
     subir_objeto_glacier()